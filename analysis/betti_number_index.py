@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class BettiNumberIndex:
+	"""
+	Index over the (birth, death) pairs of one persistence diagram that counts the features with birth < birth_before
+	and death > death_after for arbitrary thresholds, not only those of a BettiNumbersGrid.
+	It is a merge sort tree: the features are ordered by birth, and on level l the deaths are sorted within blocks of 2^l features.
+	The features born before a threshold are a prefix of the birth order, which is the union of at most one block per level,
+	so a query takes O(log^2 N) for N features and every level is searched for all queries at once.
+	"""
+
+	def __init__(self, pairs: np.ndarray):
+		"""
+		:param pairs: Array of shape (N, 2) with the (birth, death) pairs
+		"""
+		pairs = np.asarray(pairs).reshape((-1, 2))
+		self.n_features = len(pairs)
+
+		birth_order = np.argsort(pairs[:, 0], kind='stable')
+		self.sorted_births = pairs[birth_order, 0]
+		self.sorted_deaths = np.sort(pairs[:, 1])
+
+		# Rank of the death of every feature, in birth order. The deaths <= d are exactly the ranks below the number of deaths <= d
+		death_rank = np.empty(self.n_features, dtype=np.int64)
+		death_rank[np.argsort(pairs[:, 1], kind='stable')] = np.arange(self.n_features)
+		death_rank = death_rank[birth_order]
+
+		# Keys combine the block and the death rank, so every level is one sorted array in which all blocks can be searched
+		self.levels = []
+		position = np.arange(self.n_features, dtype=np.int64)
+		for level in range(int(self.n_features).bit_length()):
+			self.levels.append(np.sort((position >> level) * (self.n_features + 1) + death_rank))
+
+	def query(self, birth_before, death_after):
+		"""
+		Counts the features with birth < birth_before and death > death_after.
+		:param birth_before: Birth thresholds, an array of any shape
+		:param death_after: Death thresholds, broadcast against birth_before
+		:return: Integer array with the broadcast shape of the thresholds
+		"""
+		birth_before, death_after = np.broadcast_arrays(np.asarray(birth_before, dtype=float), np.asarray(death_after, dtype=float))
+		# Number of features born before, which are the first born_count features in birth order
+		born_count = np.searchsorted(self.sorted_births, birth_before.reshape(-1), side='left')
+		# Number of features that died at or before death_after
+		died_rank = np.searchsorted(self.sorted_deaths, death_after.reshape(-1), side='right')
+
+		counts = np.zeros(len(born_count), dtype=np.int64)
+		for level, keys in enumerate(self.levels):
+			# The prefix contains a block of this level when this bit of its length is set
+			has_block = (born_count >> level) & 1 == 1
+			block_start = (born_count >> (level + 1)) << (level + 1)
+			block = block_start >> level
+			# Features in the block that died after death_after are those from the first key with a higher death rank to the block end
+			first_alive = np.searchsorted(keys, block * (self.n_features + 1) + died_rank, side='left')
+			counts += np.where(has_block, block_start + (1 << level) - first_alive, 0)
+
+		return counts.reshape(birth_before.shape)
@@ -0,0 +1,151 @@
+import numpy as np
+
+
+def persistent_betti_numbers(births: np.ndarray, deaths: np.ndarray, birth_before: np.ndarray, death_after: np.ndarray):
+	"""
+	Counts the features with birth < birth_before[j] and death > death_after[i] for every combination of i and j.
+	Instead of comparing every feature with every grid point, the births and deaths are binned once into a 2D histogram
+	of grid cells. The count of every grid point is then read from a cumulative sum over that histogram,
+	which costs O(N + R^2) instead of O(R^2 N).
+	:param births: Birth values of the features
+	:param deaths: Death values of the features
+	:param birth_before: Birth thresholds of the grid
+	:param death_after: Death thresholds of the grid
+	:return: Array of shape (len(death_after), len(birth_before)) with the number of features
+	"""
+	return batched_persistent_betti_numbers(births, deaths, [0, len(births)], birth_before, death_after)[0]
+
+
+def triangle_indices(birth_before: np.ndarray, death_after: np.ndarray):
+	"""
+	Indices of the grid points where the birth threshold is not larger than the death threshold, the only part of
+	a grid of persistent Betti numbers that is meaningful.
+	:return: Tuple of arrays with the death (row) and birth (column) index of every grid point in the triangle
+	"""
+	return np.nonzero(birth_before[np.newaxis, :] <= death_after[:, np.newaxis])
+
+
+def triangle_to_grid(values: np.ndarray, indices, shape):
+	"""
+	Puts values of the grid points at indices (see triangle_indices) back into full grids, the other grid points are 0.
+	:param values: Array with the grid points along its last axis, any leading axes are kept
+	:param shape: Shape (len(death_after), len(birth_before)) of a full grid
+	"""
+	grids = np.zeros(values.shape[:-1] + tuple(shape), dtype=values.dtype)
+	grids[..., indices[0], indices[1]] = values
+	return grids
+
+
+def batched_persistent_betti_numbers(births: np.ndarray, deaths: np.ndarray, offsets, birth_before: np.ndarray, death_after: np.ndarray, indices=None):
+	"""
+	Same as persistent_betti_numbers, but for many diagrams at once. The features of all diagrams are concatenated,
+	diagram i consists of the features offsets[i] up to offsets[i + 1].
+	:param indices: Tuple of death and birth indices of the grid points to return (see triangle_indices), None returns the full grid
+	:return: Array of shape (len(offsets) - 1, len(death_after), len(birth_before)) with the number of features,
+		or of shape (len(offsets) - 1, len(indices[0])) when indices are given
+	"""
+	offsets = np.asarray(offsets)
+	n_diagrams = len(offsets) - 1
+
+	# Cumulative sums need the thresholds in ascending order, the result is put back in the original order at the end
+	birth_order = np.argsort(birth_before, kind='stable')
+	death_order = np.argsort(death_after, kind='stable')
+	n_birth = len(birth_before)
+	n_death = len(death_after)
+
+	# A feature counts for every birth threshold from birth_index onwards
+	birth_index = np.searchsorted(birth_before[birth_order], births[offsets[0]:offsets[-1]], side='right')
+	# A feature counts for every death threshold before death_index
+	death_index = np.searchsorted(death_after[death_order], deaths[offsets[0]:offsets[-1]], side='left')
+	diagram_index = np.repeat(np.arange(n_diagrams), np.diff(offsets))
+
+	hist = np.bincount(
+		(diagram_index * (n_death + 1) + death_index) * (n_birth + 1) + birth_index,
+		minlength=n_diagrams * (n_death + 1) * (n_birth + 1)
+	).reshape((n_diagrams, n_death + 1, n_birth + 1))
+
+	# Sum from the highest death index downwards, and from the lowest birth index upwards
+	cumulative = np.cumsum(np.cumsum(hist[:, ::-1], axis=1)[:, ::-1], axis=2)
+
+	# Position of every threshold in the sorted thresholds
+	birth_rank = np.empty(n_birth, dtype=int)
+	birth_rank[birth_order] = np.arange(n_birth)
+	death_rank = np.empty(n_death, dtype=int)
+	death_rank[death_order] = np.arange(n_death)
+
+	if indices is not None:
+		# Death threshold i only counts features with death_index > i, so the rows are shifted by one
+		return cumulative[:, death_rank[indices[0]] + 1, birth_rank[indices[1]]]
+
+	betti_numbers = np.empty((n_diagrams, n_death, n_birth), dtype=cumulative.dtype)
+	betti_numbers[:, death_order[:, np.newaxis], birth_order] = cumulative[:, 1:, :n_birth]
+	return betti_numbers
+
+
+def multi_resolution_persistent_betti_numbers(births: np.ndarray, deaths: np.ndarray, offsets, thresholds, triangle=False):
+	"""
+	Same as batched_persistent_betti_numbers, but on several grids in one pass, e.g. grids of different resolutions.
+	The thresholds of all grids are sorted together and every feature is binned once, each grid is then read from the same cumulative sums.
+	:param thresholds: List with the thresholds of each grid, which are both the birth and the death thresholds of that grid
+	:param triangle: Whether to only return the grid points in the triangle, see triangle_indices
+	:return: List with for every grid an array of shape (len(offsets) - 1, len(thresholds[k]), len(thresholds[k])),
+		or of shape (len(offsets) - 1, n_triangle) with triangle
+	"""
+	starts = np.cumsum([0] + [len(grid_thresholds) for grid_thresholds in thresholds])
+
+	# Grid points of every grid, as indices into the thresholds of all grids together
+	grids_indices = []
+	for grid_thresholds, start in zip(thresholds, starts):
+		if triangle:
+			indices = triangle_indices(grid_thresholds, grid_thresholds)
+		else:
+			indices = np.indices((len(grid_thresholds), len(grid_thresholds))).reshape((2, -1))
+		grids_indices.append((indices[0] + start, indices[1] + start))
+
+	all_thresholds = np.concatenate(thresholds)
+	values = batched_persistent_betti_numbers(
+		births, deaths, offsets, all_thresholds, all_thresholds,
+		indices=(np.concatenate([indices[0] for indices in grids_indices]), np.concatenate([indices[1] for indices in grids_indices]))
+	)
+
+	grids = []
+	ends = np.cumsum([len(indices[0]) for indices in grids_indices])
+	for grid_thresholds, indices, end in zip(thresholds, grids_indices, ends):
+		grid_values = values[:, end - len(indices[0]):end]
+		grids.append(grid_values if triangle else grid_values.reshape((-1, len(grid_thresholds), len(grid_thresholds))))
+	return grids
+
+
+def quantile_thresholds(values: np.ndarray, resolution: int):
+	"""
+	Thresholds at evenly spaced quantiles of values, e.g. the pooled births and deaths of many diagrams.
+	A grid with these thresholds has the most grid points where most features are, instead of evenly spread over the range.
+	:param values: Values to take the quantiles of, values that are not finite are ignored
+	:return: Array with resolution ascending thresholds, from the smallest to the largest value.
+		Quantiles that are equal, where many values are the same, are only given once, so there can be fewer thresholds
+	"""
+	values = np.asarray(values)
+	return np.unique(np.quantile(values[np.isfinite(values)], np.linspace(0, 1, resolution)))
+
+
+def subsample_thresholds(thresholds: np.ndarray, resolution: int):
+	"""
+	Evenly spaced subset of ascending thresholds, e.g. to give the quantile_thresholds of every dimension the same length.
+	:param thresholds: Ascending thresholds, at least resolution of them
+	:return: Array with resolution of the thresholds, including the first and the last
+	"""
+	thresholds = np.asarray(thresholds)
+	if resolution > len(thresholds):
+		raise ValueError(f'Cannot take {resolution} of {len(thresholds)} thresholds')
+	# Indices are at least 1 apart and rounded half up, so every threshold is taken at most once
+	return thresholds[np.floor(np.linspace(0, len(thresholds) - 1, resolution) + .5).astype(int)]
+
+
+def thresholds_resolution(thresholds_dim):
+	"""
+	Resolution of the BettiNumbersGrids with the thresholds of each dimension, which are stored together and need the same number of thresholds.
+	:param thresholds_dim: Thresholds of dimension 0 and 1
+	"""
+	if len(thresholds_dim[0]) != len(thresholds_dim[1]):
+		raise ValueError(f'Thresholds of dimension 0 and 1 have different lengths, {len(thresholds_dim[0])} and {len(thresholds_dim[1])}')
+	return len(thresholds_dim[0])
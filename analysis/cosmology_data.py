@@ -1,39 +1,65 @@
-
-
+import json
 import os
 import numpy as np
+import xarray as xr
 
-from analysis.persistence_diagram import BettiNumbersGridVarianceMap, BettiNumbersGrid
+from analysis.betti_numbers import thresholds_resolution, triangle_indices, triangle_to_grid
+from analysis.persistence_diagram import BettiNumbersGridVarianceMap, BettiNumbersGrid, TriangleBettiNumbersGrid, normalize_betti_numbers_grids
 
 
 class CosmologyData:
+	"""
+	BettiNumbersGrids and feature counts of all LOS of one cosmology, in every zbin.
+	The data is held in one xarray Dataset (see build_dataset), which can be saved to and loaded from a netCDF file.
+	"""
 
-	def __init__(self, 
+	def __init__(self,
 			cosmology,
 			zbins_pds=None,
 			load_averages=False,  # TODO
 			products_dir='products',
-			n_cosmoslics_los=50
+			n_cosmoslics_los=50,
+			zbins_bngs_tensors=None,
+			dataset=None,
+			smoothing_scale=None
 		):
+		"""
+		:param zbins_pds: Dictionary with the PersistenceDiagrams of every LOS for each zbin
+		:param zbins_bngs_tensors: Dictionary with the BettiNumbersGrids of each zbin as an array of shape (n_pds, 2, resolution, resolution),
+			or (n_pds, 2, n_triangle) for TriangleBettiNumbersGrids, as returned by generate_betti_numbers_grids_batched.
+			These are counts when the BettiNumbersGrids of the PersistenceDiagrams have a normalization
+		:param dataset: xarray Dataset as returned by build_dataset or build_statistics_dataset, built from zbins_pds when not given
+		:param smoothing_scale: Standard deviation in pixels of the Gaussian the maps were smoothed with (see Map.smooth), None for maps that are not smoothed.
+			It is kept in the dataset, see build_scales_dataset
+		"""
 		self.cosmology = cosmology
-		self.cosm_parameters = list(zbins_pds.values())[0][0].cosm_parameters
 		self.n_cosmoslics_los = n_cosmoslics_los
 
 		if zbins_pds is not None:
-			self.pds_count = len(list(zbins_pds.values())[0])
 			self.zbins_pds = zbins_pds
-			self.zbins_bngs = {
-				zbin: {
-					dim: [pd.betti_numbers_grids[dim] for pd in self.zbins_pds[zbin]] for dim in [0,1]
-				} for zbin in self.zbins_pds
-			}
-			self.zbins_dimension_pairs_counts = {
-				zbin: [pd.dimension_pairs_count for pd in self.zbins_pds[zbin]] 
-				for zbin in self.zbins_pds
-			}
-		
+			self.cosm_parameters = list(zbins_pds.values())[0][0].cosm_parameters
+
+			if dataset is None:
+				dataset = build_dataset(zbins_pds, zbins_bngs_tensors)
+
+				# The BettiNumbersGrids of the PersistenceDiagrams become views into the dataset, so the grids are not held twice
+				grids_variable = _grids_variable(dataset)
+				for zbin in zbins_pds:
+					for i, perdi in enumerate(zbins_pds[zbin]):
+						for dim in [0, 1]:
+							perdi.betti_numbers_grids[dim].set_stored_map(dataset[grids_variable].sel(zbin=zbin).values[i, dim])
+		else:
+			self.cosm_parameters = json.loads(dataset.attrs['cosm_parameters'])
+
+		if smoothing_scale is not None:
+			dataset.attrs['smoothing_scale'] = smoothing_scale
+		self.smoothing_scale = dataset.attrs.get('smoothing_scale')
+
+		self.data = dataset
+		self.pds_count = dataset.sizes['los']
+
 		# Sort alphabetically
-		sorted = np.sort(list(zbins_pds.keys()))
+		sorted = np.sort(dataset.zbin.values.astype(str))
 		# Sort by length of name to ensure crossbins at the end
 		sorted = sorted[np.argsort([len(zb) for zb in sorted])]
 		# Put widest bin in front
@@ -45,28 +71,129 @@ class CosmologyData:
 
 		self.calculate_averages()
 
+	def __getattr__(self, item):
+		# Per LOS data is only taken from the dataset when it is needed, a lazily loaded dataset then reads it from the file.
+		# A dataset from build_statistics_dataset has no per LOS data
+		if item == 'zbins_bngs_tensors':
+			# Counts are normalized here, the normalized grids are not stored
+			if self._has_counts():
+				self.zbins_bngs_tensors = {
+					zbin: normalize_betti_numbers_grids(self.data.bng_counts.sel(zbin=zbin).values, self.data.bng_normalization.sel(zbin=zbin).values)
+					for zbin in self.zbins
+				}
+			else:
+				self.zbins_bngs_tensors = {zbin: self.data.bngs.sel(zbin=zbin).values for zbin in self.zbins}
+			return self.zbins_bngs_tensors
+		if item == 'zbins_bngs':
+			if self._has_counts():
+				# BettiNumbersGrids of counts, normalized when they are accessed
+				self.zbins_bngs = {
+					zbin: {
+						dim: [
+							self._create_bng(counts[dim], dim, normalization[dim])
+							for counts, normalization in zip(self.data.bng_counts.sel(zbin=zbin).values, self.data.bng_normalization.sel(zbin=zbin).values)
+						] for dim in [0, 1]
+					} for zbin in self.zbins
+				}
+			else:
+				self.zbins_bngs = {
+					zbin: {
+						dim: [self._create_bng(bngs[dim], dim) for bngs in self.zbins_bngs_tensors[zbin]] for dim in [0, 1]
+					} for zbin in self.zbins
+				}
+			return self.zbins_bngs
+		if item == 'zbins_dimension_pairs_counts':
+			self.zbins_dimension_pairs_counts = {
+				zbin: list(self.data.dimension_pairs_count.sel(zbin=zbin).values) for zbin in self.zbins
+			}
+			return self.zbins_dimension_pairs_counts
+		return super().__getattribute__(item)
+
+	def _birth_range(self, dim):
+		return self.data.birth_range.values[dim]
+
+	def _death_range(self, dim):
+		return self.data.death_range.values[dim]
+
+	def _thresholds(self, dim):
+		# Thresholds of grids that are not evenly spaced
+		return self.data.bng_thresholds.values[dim] if 'bng_thresholds' in self.data else None
+
+	def _is_triangle(self):
+		# Per LOS grids are stored as TriangleBettiNumbersGrid values
+		grids_variable = _grids_variable(self.data)
+		return grids_variable is not None and 'cell' in self.data[grids_variable].dims
+
+	def _has_counts(self):
+		# Per LOS grids are stored as counts with a normalization
+		return 'bng_counts' in self.data
+
+	def _create_bng(self, values, dim, normalization=None):
+		if self._is_triangle():
+			return TriangleBettiNumbersGrid(
+				values, self._birth_range(dim), self._death_range(dim), dim, int(self.data.attrs['resolution']),
+				normalization=normalization, thresholds=self._thresholds(dim)
+			)
+		return BettiNumbersGrid(values, self._birth_range(dim), self._death_range(dim), dim, normalization=normalization, thresholds=self._thresholds(dim))
+
+	def _to_grid(self, values, dim):
+		# Full grid of per LOS values, which are triangle values for TriangleBettiNumbersGrids
+		if not self._is_triangle():
+			return values
+		resolution = int(self.data.attrs['resolution'])
+		indices = triangle_indices(np.linspace(*self._birth_range(dim), resolution), np.linspace(*self._death_range(dim), resolution))
+		return triangle_to_grid(values, indices, (resolution, resolution))
+
 	def calculate_averages(self, return_std=False):
+		# Averages saved with the dataset do not need to be calculated again
+		if 'bngs_avg' in self.data:
+			bngs_avg = self.data.bngs_avg.values
+			bngs_std = self.data.bngs_std.values
+			dimension_pairs_count_avg = self.data.dimension_pairs_count_avg.values
+		else:
+			zbin_index = {zbin: i for i, zbin in enumerate(self.data.zbin.values.astype(str))}
+			tensors = self.zbins_bngs_tensors
+			grids = self.data[_grids_variable(self.data)]
+			bngs_avg = np.empty(grids.shape[:1] + self._to_grid(grids.values[0, 0], 0).shape)
+			bngs_std = np.empty_like(bngs_avg)
+			bng_counts_avg = np.empty_like(bngs_avg) if self._has_counts() else None
+			for zbin in self.zbins:
+				for dim in [0, 1]:
+					# The averages are always full grids
+					bngs_avg[zbin_index[zbin], dim] = self._to_grid(np.mean(tensors[zbin][:, dim], axis=0), dim)
+					bngs_std[zbin_index[zbin], dim] = self._to_grid(BettiNumbersGridVarianceMap(tensors[zbin][:, dim]).map, dim)
+					if bng_counts_avg is not None:
+						bng_counts_avg[zbin_index[zbin], dim] = self._to_grid(np.mean(grids.sel(zbin=zbin).values[:, dim], axis=0), dim)
+			dimension_pairs_count_avg = np.mean(self.data.dimension_pairs_count.values, axis=1)
+
+			self.data['bngs_avg'] = (('zbin', 'dim', 'death', 'birth'), bngs_avg)
+			self.data['bngs_std'] = (('zbin', 'dim', 'death', 'birth'), bngs_std)
+			self.data['dimension_pairs_count_avg'] = (('zbin', 'dim'), dimension_pairs_count_avg)
+			if bng_counts_avg is not None:
+				self.data['bng_counts_avg'] = (('zbin', 'dim', 'death', 'birth'), bng_counts_avg)
+
+		zbin_index = {zbin: i for i, zbin in enumerate(self.data.zbin.values.astype(str))}
+
 		# Calculate average BNG for each zbin
 		self.zbins_bngs_avg = {
 			zbin: [
 				BettiNumbersGrid(
-					np.mean([pd.betti_numbers_grids[dim].map for pd in self.zbins_pds[zbin]], axis=0),
-					self.zbins_pds[zbin][0].betti_numbers_grids[dim].x_range,
-					self.zbins_pds[zbin][0].betti_numbers_grids[dim].y_range,
-					dim
+					bngs_avg[zbin_index[zbin], dim], self._birth_range(dim), self._death_range(dim), dim, thresholds=self._thresholds(dim)
 				) for dim in [0,1]
-			] for zbin in self.zbins_pds
+			] for zbin in self.zbins
 		}
 
 		# Calculate std of BNG within each zbin
 		self.zbins_bngs_std = {}
 
-		for zbin in self.zbins_pds:
+		for zbin in self.zbins:
 
 			self.zbins_bngs_std[zbin] = []
 
 			for dim in [0, 1]:
-				self.zbins_bngs_std[zbin].append(BettiNumbersGridVarianceMap(self.zbins_bngs[zbin][dim]))
+				self.zbins_bngs_std[zbin].append(BettiNumbersGridVarianceMap.from_std(
+					bngs_std[zbin_index[zbin], dim], self._birth_range(dim), self._death_range(dim), dim, thresholds=self._thresholds(dim)
+				))
 
 				# # SLICS variance goes down as 1/sqrt(n_los_cosmoslics) (basically, number of measurements)
 				# if self.cosmology == 'SLICS':
@@ -74,18 +201,195 @@ class CosmologyData:
 
 		# Calculate average dimension pairs counts in each zbin
 		self.dimension_pairs_count_avg = {
-			zbin: [
-				np.mean([pd.dimension_pairs_count[dim] for pd in self.zbins_pds[zbin]]) for dim in [0,1]
-			] for zbin in self.zbins_pds
+			zbin: list(dimension_pairs_count_avg[zbin_index[zbin]]) for zbin in self.zbins
 		}
 
+		# Average counts of each zbin, only known when the BettiNumbersGrids were stored as counts
+		if 'bng_counts_avg' in self.data:
+			self.zbins_bng_counts_avg = {
+				zbin: [
+					BettiNumbersGrid(
+						self.data.bng_counts_avg.values[zbin_index[zbin], dim], self._birth_range(dim), self._death_range(dim), dim,
+						thresholds=self._thresholds(dim)
+					) for dim in [0, 1]
+				] for zbin in self.zbins
+			}
+		else:
+			self.zbins_bng_counts_avg = None
+
 		if return_std:
 			return self.zbins_bngs_avg, self.zbins_bngs_std
 		else:
 			return self.zbins_bngs_avg
-		
-	def save(self):
-		pass
 
-	def load(self, path):
-		pass
\ No newline at end of file
+	def get_feature_counts_avg(self, zbin, dim):
+		"""
+		:return: BettiNumbersGrid with the average number of features counted at every grid point. Without counts it is estimated
+			from the average normalized BettiNumbersGrid and the average number of features
+		"""
+		if self.zbins_bng_counts_avg is not None:
+			return self.zbins_bng_counts_avg[zbin][dim]
+		return BettiNumbersGrid(
+			self.dimension_pairs_count_avg[zbin][dim] * self.zbins_bngs_avg[zbin][dim].map, self._birth_range(dim), self._death_range(dim), dim,
+			thresholds=self._thresholds(dim)
+		)
+
+	def save(self, path=None):
+		"""
+		Saves the dataset to a netCDF (HDF5) file, chunked per LOS so single BettiNumbersGrids can be read without reading the rest.
+		:param path: Defaults to cosmology_data.nc in products_loc
+		"""
+		if path is None:
+			path = os.path.join(self.products_loc, 'cosmology_data.nc')
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+		dataset = self.data.copy()
+		dataset.attrs['cosmology'] = self.cosmology
+		dataset.attrs['n_cosmoslics_los'] = self.n_cosmoslics_los
+		grids_variable = _grids_variable(self.data)
+		encoding = {}
+		# A dataset from build_statistics_dataset has no per LOS BettiNumbersGrids
+		if grids_variable is not None:
+			encoding[grids_variable] = {'chunksizes': (1, 1, *self.data[grids_variable].shape[2:]), 'zlib': True}
+		dataset.to_netcdf(path, engine='h5netcdf', encoding=encoding)
+		return path
+
+	@classmethod
+	def load(cls, path, lazy=True, products_dir='products', scale=None):
+		"""
+		Loads a CosmologyData saved with save, or one scale of a dataset from build_scales_dataset.
+		:param lazy: Whether to only read the per LOS BettiNumbersGrids from the file when they are first needed,
+			the averages are always read directly
+		:param scale: Smoothing scale to load from a dataset with a scale dimension
+		"""
+		dataset = xr.open_dataset(path, engine='h5netcdf')
+		if 'scale' in dataset.dims:
+			dataset = dataset.sel(scale=scale, drop=True)
+			dataset.attrs['smoothing_scale'] = scale
+		if not lazy:
+			dataset = dataset.load()
+		return cls(dataset.attrs['cosmology'], n_cosmoslics_los=int(dataset.attrs['n_cosmoslics_los']), products_dir=products_dir, dataset=dataset)
+
+
+def build_scales_dataset(scales_datas):
+	"""
+	Stacks the datasets of the CosmologyDatas of one cosmology at several smoothing scales along a scale dimension,
+	which can be saved to one netCDF file and loaded per scale with CosmologyData.load.
+	:param scales_datas: Dictionary with the CosmologyData of every smoothing scale, e.g. from Pipeline.scales_slics_data
+	"""
+	scales = list(scales_datas.keys())
+	first_data = scales_datas[scales[0]]
+	dataset = xr.concat([scales_datas[scale].data for scale in scales], dim='scale', combine_attrs='drop_conflicts')
+	dataset = dataset.assign_coords(scale=np.array(scales, dtype=float))
+	dataset.attrs['cosmology'] = first_data.cosmology
+	dataset.attrs['n_cosmoslics_los'] = first_data.n_cosmoslics_los
+	return dataset
+
+
+def _grids_variable(dataset):
+	# Variable with the per LOS BettiNumbersGrids, None for a dataset from build_statistics_dataset
+	for variable in ['bngs', 'bng_counts']:
+		if variable in dataset:
+			return variable
+	return None
+
+
+def build_dataset(zbins_pds, zbins_bngs_tensors=None):
+	"""
+	Builds the xarray Dataset of a CosmologyData from the PersistenceDiagrams of every LOS in each zbin, it holds:
+		bngs: BettiNumbersGrids with dimensions (zbin, los, dim, death, birth), in the layout of the grids
+		bng_counts, bng_normalization: Instead of bngs when the BettiNumbersGrids hold counts,
+			the counts in their integer dtype and the normalization of every grid with dimensions (zbin, los, dim)
+		dimension_pairs_count: Number of features with dimensions (zbin, los, dim)
+		birth_range, death_range: Ranges of the BettiNumbersGrids of each dimension
+		bng_thresholds: Only for grids that are not evenly spaced, the thresholds of each dimension with dimensions (dim, threshold)
+	Every zbin must have the same LOS.
+	"""
+	zbins = list(zbins_pds.keys())
+	los = [perdi.los for perdi in zbins_pds[zbins[0]]]
+	for zbin in zbins:
+		if [perdi.los for perdi in zbins_pds[zbin]] != los:
+			raise ValueError(f'LOS of {zbin} are different from the LOS of {zbins[0]}')
+
+	first_pd = zbins_pds[zbins[0]][0]
+	triangle = isinstance(first_pd.betti_numbers_grids[0], TriangleBettiNumbersGrid)
+	counts = first_pd.betti_numbers_grids[0].normalization is not None
+
+	if zbins_bngs_tensors is None:
+		zbins_bngs_tensors = {
+			zbin: np.array([[pd.betti_numbers_grids[dim].get_stored_map() for dim in [0, 1]] for pd in zbins_pds[zbin]])
+			for zbin in zbins
+		}
+
+	attrs = {'cosm_parameters': json.dumps(first_pd.cosm_parameters, default=lambda value: value.item())}
+	if triangle:
+		attrs['resolution'] = first_pd.betti_numbers_grids[0].resolution
+
+	# TriangleBettiNumbersGrids have a cell dimension with the grid points of the triangle instead of death and birth
+	grids_dims = ('zbin', 'los', 'dim', 'cell') if triangle else ('zbin', 'los', 'dim', 'death', 'birth')
+	grids = {'bng_counts' if counts else 'bngs': (grids_dims, np.stack([zbins_bngs_tensors[zbin] for zbin in zbins]))}
+	if counts:
+		grids['bng_normalization'] = (('zbin', 'los', 'dim'), np.array([
+			[[pd.betti_numbers_grids[dim].normalization for dim in [0, 1]] for pd in zbins_pds[zbin]] for zbin in zbins
+		]))
+	if not first_pd.betti_numbers_grids[0].has_uniform_axes():
+		grids['bng_thresholds'] = (('dim', 'threshold'), np.array([first_pd.betti_numbers_grids[dim].get_axis_values('x') for dim in [0, 1]]))
+
+	dataset = xr.Dataset(
+		{
+			**grids,
+			'dimension_pairs_count': (('zbin', 'los', 'dim'), np.array([
+				[pd.dimension_pairs_count for pd in zbins_pds[zbin]] for zbin in zbins
+			], dtype=float)),
+			'birth_range': (('dim', 'bound'), np.array([first_pd.betti_numbers_grids[dim].x_range for dim in [0, 1]], dtype=float)),
+			'death_range': (('dim', 'bound'), np.array([first_pd.betti_numbers_grids[dim].y_range for dim in [0, 1]], dtype=float))
+		},
+		coords={'zbin': zbins, 'los': los, 'dim': [0, 1]},
+		# netCDF attributes cannot hold dictionaries
+		attrs=attrs
+	)
+	return dataset
+
+
+def build_statistics_dataset(zbins_statistics, los, data_ranges_dim, cosm_parameters, resolution=100, thresholds_dim=None):
+	"""
+	Builds the xarray Dataset of a CosmologyData from RunningStatistics, without the BettiNumbersGrids of every LOS.
+	It only holds the averages and standard deviations, see build_dataset.
+	:param zbins_statistics: Dictionary with for each zbin a dictionary with RunningStatistics of 'bngs' (shape (2, resolution, resolution))
+		and 'dimension_pairs_count' (shape (2,)), and optionally of the counts in 'bng_counts'
+	:param los: LOS that were added to the statistics
+	:param data_ranges_dim: Birth (= death) range of the BettiNumbersGrids of each dimension
+	:param resolution: Resolution of the BettiNumbersGrids, statistics of triangle values are put into full grids
+	:param thresholds_dim: Thresholds of each dimension of grids that are not evenly spaced, these then give the range and resolution
+	"""
+	zbins = list(zbins_statistics.keys())
+	statistics = {}
+	if thresholds_dim is not None:
+		statistics['bng_thresholds'] = (('dim', 'threshold'), np.array([thresholds_dim[dim] for dim in [0, 1]]))
+		data_ranges_dim = {dim: [thresholds_dim[dim][0], thresholds_dim[dim][-1]] for dim in [0, 1]}
+		resolution = thresholds_resolution(thresholds_dim)
+	data_ranges = np.array([data_ranges_dim[dim] for dim in [0, 1]], dtype=float)
+
+	def to_grids(values):
+		if values.ndim == 3:
+			return values
+		return np.array([
+			triangle_to_grid(values[dim], triangle_indices(*[np.linspace(*data_ranges[dim], resolution)] * 2), (resolution, resolution)) for dim in [0, 1]
+		])
+
+	if all('bng_counts' in zbins_statistics[zbin] for zbin in zbins):
+		statistics['bng_counts_avg'] = (('zbin', 'dim', 'death', 'birth'), np.array([to_grids(zbins_statistics[zbin]['bng_counts'].mean) for zbin in zbins]))
+
+	dataset = xr.Dataset(
+		{
+			**statistics,
+			'bngs_avg': (('zbin', 'dim', 'death', 'birth'), np.array([to_grids(zbins_statistics[zbin]['bngs'].mean) for zbin in zbins])),
+			'bngs_std': (('zbin', 'dim', 'death', 'birth'), np.array([to_grids(zbins_statistics[zbin]['bngs'].std) for zbin in zbins])),
+			'dimension_pairs_count_avg': (('zbin', 'dim'), np.array([zbins_statistics[zbin]['dimension_pairs_count'].mean for zbin in zbins])),
+			'birth_range': (('dim', 'bound'), data_ranges),
+			'death_range': (('dim', 'bound'), data_ranges)
+		},
+		coords={'zbin': zbins, 'los': los, 'dim': [0, 1]},
+		attrs={'cosm_parameters': json.dumps(cosm_parameters, default=lambda value: value.item())}
+	)
+	return dataset
@@ -0,0 +1,300 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Id of the node outside the map in the superlevel filtration, pixels have their flat index in the map as id
+OUTSIDE_ID = -1
+
+
+def _grid_edges(shape, diagonal):
+	"""
+	Edges between neighbouring pixels of a 2D grid, as flat pixel indices.
+	:param diagonal: Whether pixels that only share a corner are neighbours (8-connectivity) or not (4-connectivity)
+	"""
+	index = np.arange(shape[0] * shape[1]).reshape(shape)
+	pairs = [(index[:, :-1], index[:, 1:]), (index[:-1, :], index[1:, :])]
+	if diagonal:
+		pairs += [(index[:-1, :-1], index[1:, 1:]), (index[:-1, 1:], index[1:, :-1])]
+	return np.concatenate([u.ravel() for u, _ in pairs]), np.concatenate([v.ravel() for _, v in pairs])
+
+
+def _spanning_edges(n_nodes, a: np.ndarray, b: np.ndarray, weight: np.ndarray):
+	"""
+	Edges of the minimum spanning forest of a graph with integer weights >= 0, sorted by weight.
+	Only the edges of a minimum spanning tree merge components, so the other edges can be dropped before merging.
+	"""
+	from scipy.sparse import coo_matrix
+	from scipy.sparse.csgraph import minimum_spanning_tree
+
+	# Only the lightest edge between every two nodes, duplicates would be summed in the sparse matrix
+	a, b = np.minimum(a, b), np.maximum(a, b)
+	edge_order = np.lexsort((weight, b, a))
+	first = np.ones(len(edge_order), dtype=bool)
+	first[1:] = (np.diff(a[edge_order]) != 0) | (np.diff(b[edge_order]) != 0)
+	a, b, weight = a[edge_order][first], b[edge_order][first], weight[edge_order][first]
+
+	# Weights are shifted by one, the minimum spanning tree ignores edges of weight 0
+	tree = minimum_spanning_tree(coo_matrix((weight + 1, (a, b)), shape=(n_nodes, n_nodes))).tocoo()
+	tree_order = np.argsort(tree.data, kind='stable')
+	return tree.row[tree_order], tree.col[tree_order], tree.data[tree_order].astype(np.int64) - 1
+
+
+def _basin_forest(rank: np.ndarray, u: np.ndarray, v: np.ndarray):
+	"""
+	Reduces a graph whose nodes enter in the order of rank, where an edge enters with its last node, to a forest on the local minima
+	with the same 0-dimensional persistence.
+	Every node first follows its lowest ranked neighbour down to a local minimum, which groups the nodes into basins at once.
+	The nodes of a basin are connected as soon as they entered, so only the minimum spanning forest of the graph of basins is kept.
+	:param rank: Position of every node in the filtration, a permutation of 0 up to the number of nodes
+	:param u: First node of every edge
+	:param v: Second node of every edge
+	:return: Node of the minimum of every basin, the basin index of every node, and the two basin indices and the rank of every edge of the forest,
+		sorted by rank
+	"""
+	order = np.empty_like(rank)
+	order[rank] = np.arange(len(rank))
+
+	# Lowest ranked neighbour that entered before the node, or the node itself at a local minimum
+	lowest = rank.copy()
+	np.minimum.at(lowest, u, rank[v])
+	np.minimum.at(lowest, v, rank[u])
+	basin = order[lowest]
+	while True:
+		next_basin = basin[basin]
+		if np.array_equal(next_basin, basin):
+			break
+		basin = next_basin
+
+	crossing = basin[u] != basin[v]
+	basins, basin_index = np.unique(basin, return_inverse=True)
+	a, b, weight = _spanning_edges(
+		len(basins), basin_index[u[crossing]], basin_index[v[crossing]], np.maximum(rank[u[crossing]], rank[v[crossing]])
+	)
+	return basins, basin_index, a, b, weight
+
+
+def _elder_pairs(birth: np.ndarray, a: np.ndarray, b: np.ndarray, weight: np.ndarray, boundary: np.ndarray=None):
+	"""
+	Merges the components along the edges of a forest sorted by weight with a union-find.
+	Elder rule: when two components merge, the one that was born last dies.
+	:param birth: Birth rank of every node
+	:param boundary: Whether every node is connected to nodes outside this graph, e.g. in another tile. A component with such a node
+		may merge outside this graph first, so its pair is deferred instead: the merge is returned as an edge between the two components
+	:return: Birth and death rank of every pair. With boundary also the two component nodes and the weight of the deferred merges,
+		and the nodes of the components that are left
+	"""
+	deferring = boundary is not None
+	parent = list(range(len(birth)))
+	birth = birth.tolist()
+	boundary = boundary.tolist() if deferring else [False] * len(birth)
+	birth_ranks = []
+	death_ranks = []
+	deferred = []
+	for x, y, death in zip(a.tolist(), b.tolist(), weight.tolist()):
+		while parent[x] != x:
+			parent[x] = parent[parent[x]]
+			x = parent[x]
+		while parent[y] != y:
+			parent[y] = parent[parent[y]]
+			y = parent[y]
+		if birth[x] < birth[y]:
+			x, y = y, x
+		if boundary[x]:
+			deferred.append((x, y, death))
+			boundary[y] = True
+		else:
+			birth_ranks.append(birth[x])
+			death_ranks.append(death)
+		parent[x] = y
+
+	pairs = np.array(birth_ranks, dtype=np.int64), np.array(death_ranks, dtype=np.int64)
+	if not deferring:
+		return pairs
+	deferred = np.array(deferred, dtype=np.int64).reshape((-1, 3))
+	roots = np.nonzero(np.arange(len(parent)) == np.array(parent))[0]
+	return (*pairs, deferred[:, 0], deferred[:, 1], deferred[:, 2], roots)
+
+
+def _reduce_tile(tile: np.ndarray, row, column, map_shape, superlevel):
+	"""
+	Calculates the 0-dimensional persistence pairs of one tile of a map that do not depend on the other tiles, and reduces the rest of the tile
+	to a few nodes and edges. Nodes are identified by their id and ordered by their key (value, id), where the value is minus the pixel value
+	in the superlevel filtration. The tile is reduced to its basin forest (see _basin_forest), of which every component that dies before it reaches
+	a pixel next to another tile has its final pair. Only the merges of the other components are kept, see _elder_pairs.
+	:param row: Row of the first pixel of the tile in the map
+	:param column: Column of the first pixel of the tile in the map
+	:param superlevel: Whether to use the superlevel filtration with 4-connected pixels and the outside, instead of the sublevel filtration with 8-connected pixels
+	:return: Dictionary with the birth and death key values of the final pairs, the ids and key values of the nodes that are left,
+		the node ids and the weight key (id and value) of the kept merges, and the ids and node ids of the pixels next to other tiles
+	"""
+	height, width = tile.shape
+	rows = row + np.arange(height)[:, np.newaxis]
+	columns = column + np.arange(width)[np.newaxis, :]
+	ids = (rows * map_shape[1] + columns).ravel()
+	values = np.asarray(tile, dtype=np.float64).ravel()
+	if superlevel:
+		values = -values
+	u, v = _grid_edges(tile.shape, diagonal=not superlevel)
+
+	# Pixels with a neighbour in another tile
+	next_to_tile = (
+		((rows == row) & (row > 0)) | ((rows == row + height - 1) & (row + height < map_shape[0]))
+		| ((columns == column) & (column > 0)) | ((columns == column + width - 1) & (column + width < map_shape[1]))
+	).ravel()
+
+	if superlevel:
+		# Pixels on the edge of the map are connected to the outside, which enters first and is shared by all tiles
+		on_map_edge = ((rows == 0) | (rows == map_shape[0] - 1) | (columns == 0) | (columns == map_shape[1] - 1)).ravel()
+		if np.any(on_map_edge):
+			u = np.concatenate((u, np.nonzero(on_map_edge)[0]))
+			v = np.concatenate((v, np.full(np.sum(on_map_edge), len(ids))))
+			ids = np.append(ids, OUTSIDE_ID)
+			values = np.append(values, -np.inf)
+			next_to_tile = np.append(next_to_tile, True)
+
+	order = np.lexsort((ids, values))
+	rank = np.empty(len(ids), dtype=np.int64)
+	rank[order] = np.arange(len(ids))
+	basins, basin_index, a, b, weight = _basin_forest(rank, u, v)
+
+	boundary = np.zeros(len(basins), dtype=bool)
+	boundary[basin_index[next_to_tile]] = True
+	# A single tile has no boundary, its pairs are all final except for the component that never dies
+	boundary[np.argmin(rank[basins])] = True
+	birth_ranks, death_ranks, x, y, weight, roots = _elder_pairs(rank[basins], a, b, weight, boundary)
+
+	nodes = np.unique(np.concatenate((x, y, roots, basin_index[next_to_tile])))
+	frame = np.nonzero(next_to_tile)[0]
+	return {
+		'births': values[order[birth_ranks]],
+		'deaths': values[order[death_ranks]],
+		'ids': ids[basins[nodes]],
+		'values': values[basins[nodes]],
+		'a': ids[basins[x]],
+		'b': ids[basins[y]],
+		'weight_ids': ids[order[weight]],
+		'weight_values': values[order[weight]],
+		'frame_ids': ids[frame],
+		'frame_nodes': ids[basins[basin_index[frame]]]
+	}
+
+
+def _cross_tile_edges(shape, tile_size, diagonal):
+	"""
+	Edges between neighbouring pixels in different tiles, as flat pixel indices.
+	"""
+	height, width = shape
+	u = []
+	v = []
+	rows = np.arange(height)
+	for column in range(tile_size, width, tile_size):
+		# Between the last column of a tile and the first column of the next tile
+		u += [rows * width + column - 1]
+		v += [rows * width + column]
+		if diagonal:
+			u += [rows[:-1] * width + column - 1, rows[1:] * width + column - 1]
+			v += [rows[1:] * width + column, rows[:-1] * width + column]
+	columns = np.arange(width)
+	for row in range(tile_size, height, tile_size):
+		u += [(row - 1) * width + columns]
+		v += [row * width + columns]
+		if diagonal:
+			# Diagonals that also cross a boundary between columns were added above
+			same_tile = columns[:-1] // tile_size == columns[1:] // tile_size
+			u += [(row - 1) * width + columns[:-1][same_tile], (row - 1) * width + columns[1:][same_tile]]
+			v += [row * width + columns[1:][same_tile], row * width + columns[:-1][same_tile]]
+	if len(u) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	return np.concatenate(u), np.concatenate(v)
+
+
+def _zero_dimensional_pairs(map: np.ndarray, superlevel, tile_size, executor):
+	"""
+	0-dimensional persistence pairs of the sublevel or superlevel filtration (see _reduce_tile) of a map, calculated per tile.
+	The basin forests of all tiles together with the edges between tiles have the same persistence as the whole map.
+	:return: Arrays with the birth and death key value of every pair, and the lowest key value
+	"""
+	tiles = [
+		(map[row:row + tile_size, column:column + tile_size], row, column, map.shape, superlevel)
+		for row in range(0, map.shape[0], tile_size) for column in range(0, map.shape[1], tile_size)
+	]
+	if executor is not None:
+		reduced = list(executor.map(_reduce_tile, *zip(*tiles)))
+	else:
+		reduced = [_reduce_tile(*tile) for tile in tiles]
+
+	a = np.concatenate([tile['a'] for tile in reduced])
+	b = np.concatenate([tile['b'] for tile in reduced])
+	weight_ids = np.concatenate([tile['weight_ids'] for tile in reduced])
+	weight_values = np.concatenate([tile['weight_values'] for tile in reduced])
+
+	# Edges between tiles connect the basins of their pixels and enter with their last pixel
+	u, v = _cross_tile_edges(map.shape, tile_size, diagonal=not superlevel)
+	if len(u) > 0:
+		frame_ids = np.concatenate([tile['frame_ids'] for tile in reduced])
+		frame_nodes = np.concatenate([tile['frame_nodes'] for tile in reduced])
+		frame_order = np.argsort(frame_ids)
+		u_values = np.asarray(map.reshape(-1)[u], dtype=np.float64)
+		v_values = np.asarray(map.reshape(-1)[v], dtype=np.float64)
+		if superlevel:
+			u_values, v_values = -u_values, -v_values
+		u_last = (u_values > v_values) | ((u_values == v_values) & (u > v))
+
+		a = np.concatenate((a, frame_nodes[frame_order[np.searchsorted(frame_ids, u, sorter=frame_order)]]))
+		b = np.concatenate((b, frame_nodes[frame_order[np.searchsorted(frame_ids, v, sorter=frame_order)]]))
+		weight_ids = np.concatenate((weight_ids, np.where(u_last, u, v)))
+		weight_values = np.concatenate((weight_values, np.where(u_last, u_values, v_values)))
+
+	# Rank of every node and edge key among all keys. The outside is a node of every tile on the edge of the map
+	node_ids, node_index = np.unique(np.concatenate([tile['ids'] for tile in reduced]), return_index=True)
+	node_values = np.concatenate([tile['values'] for tile in reduced])[node_index]
+	key_ids, key_index = np.unique(np.concatenate((node_ids, weight_ids)), return_index=True)
+	key_values = np.concatenate((node_values, weight_values))[key_index]
+	key_order = np.lexsort((key_ids, key_values))
+	key_rank = np.empty(len(key_ids), dtype=np.int64)
+	key_rank[key_order] = np.arange(len(key_ids))
+
+	a, b, weight = _spanning_edges(
+		len(node_ids), np.searchsorted(node_ids, a), np.searchsorted(node_ids, b), key_rank[np.searchsorted(key_ids, weight_ids)]
+	)
+	birth_ranks, death_ranks = _elder_pairs(key_rank[np.searchsorted(key_ids, node_ids)], a, b, weight)
+	sorted_values = key_values[key_order]
+	births = np.concatenate([tile['births'] for tile in reduced] + [sorted_values[birth_ranks]])
+	deaths = np.concatenate([tile['deaths'] for tile in reduced] + [sorted_values[death_ranks]])
+	return births, deaths, sorted_values[0]
+
+
+def cubical_persistence_pairs(map: np.ndarray, tile_size=None, n_workers=1):
+	"""
+	Persistence pairs of the sublevel filtration of a 2D map of pixel values, the same as those of gudhi.CubicalComplex(top_dimensional_cells=map).
+	Masked pixels are inf, they enter last. Pairs with a birth equal to their death are left out.
+	Dimension 0 follows from a union-find over the pixels, where pixels that share a corner are connected.
+	Dimension 1 follows by duality from dimension 0 of the superlevel filtration, where pixels are connected when they share a side
+	and the pixels at the edge of the map are connected to the outside, which enters first:
+	a hole is born when its pixels are cut off from the outside and dies with its last pixel.
+	:param tile_size: Calculate the persistence in square tiles of tile_size pixels, which are reduced separately and merged exactly afterwards.
+		Memory of the reduction then depends on the tile size instead of the map size, None uses the whole map as one tile
+	:param n_workers: Number of processes reducing the tiles, 1 reduces them in this process
+	:return: Dictionary with an array of shape (n_pairs, 2) of (birth, death) pairs for dimension 0 and 1
+	"""
+	map = np.asarray(map)
+	if tile_size is None:
+		tile_size = max(map.shape)
+	executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+
+	dimension_pairs = {}
+	try:
+		births, deaths, lowest = _zero_dimensional_pairs(map, False, tile_size, executor)
+		# The component of the lowest pixel never dies
+		pairs = np.concatenate((np.stack((births, deaths), axis=1), [[lowest, np.inf]]))
+		dimension_pairs[0] = pairs[pairs[:, 1] > pairs[:, 0]].reshape((-1, 2))
+
+		# A superlevel component born at minus value r and dying at minus value s is a hole from value s until value r
+		births, deaths, _ = _zero_dimensional_pairs(map, True, tile_size, executor)
+		pairs = np.stack((-deaths, -births), axis=1)
+		dimension_pairs[1] = pairs[pairs[:, 1] > pairs[:, 0]].reshape((-1, 2))
+	finally:
+		if executor is not None:
+			executor.shutdown()
+
+	return dimension_pairs
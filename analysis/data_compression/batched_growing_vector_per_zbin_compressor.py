@@ -31,7 +31,7 @@ class BatchedGrowingVectorPerZbinCompressor(BatchedGrowingVectorCompressor):
 		self.pixel_scores = self.criterium.pixel_scores()
 		self.pixel_scores_shape = self.pixel_scores.shape
 
-		feature_counts = [[[cdata.dimension_pairs_count_avg[zbin][dim] * cdata.zbins_bngs_avg[zbin][dim]._transform_map() for dim in [0, 1]] for zbin in self.zbins] for cdata in cosmoslics_datas]
+		feature_counts = [[[cdata.get_feature_counts_avg(zbin, dim)._transform_map() for dim in [0, 1]] for zbin in self.zbins] for cdata in cosmoslics_datas]
 		# Axis=0 is the outermost [] in the list comprehension above
 		self.max_feature_count = np.max(feature_counts, axis=0)
 
@@ -39,7 +39,7 @@ class FisherInformation(Criterium):
 		dets = np.linalg.det(move_ax)
 
 		# Minus to make argsort descending order
-		return np.reshape(dets, (len(self.slics_data[0].zbins_pds), 2, 100, 100))
+		return np.reshape(dets, (len(self.slics_data[0].zbins), 2, 100, 100))
 	
 	def plot(self):
 		fig, ax = plt.subplots()
@@ -11,7 +11,7 @@ class FullGrid(IndexCompressor):
 
 	def __init__(self, cosmoslics_datas: List[CosmologyData], slics_data: List[CosmologyData]):
 		# Build set of indices that contain all entries
-		indices = np.indices((len(slics_data[0].zbins_pds), 2, 100, 100))
+		indices = np.indices((len(slics_data[0].zbins), 2, 100, 100))
 		super().__init__(cosmoslics_datas, slics_data, indices=indices.T)
 
 	def _calculate_fisher_matrix(self):
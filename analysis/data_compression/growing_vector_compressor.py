@@ -48,7 +48,7 @@ class GrowingVectorCompressor(IndexCompressor):
 		# So, we build one large array of (cosmologies, zbins, dim, bng_resolution, bng_resolution)
 		# Then, we can np.max over axis=0 (cosmologies) to find which pixels adhere to > minimum_feature_count
 		# And filter out all others
-		feature_counts = [[[cdata.dimension_pairs_count_avg[zbin][dim] * cdata.zbins_bngs_avg[zbin][dim]._transform_map() for dim in [0, 1]] for zbin in self.zbins] for cdata in cosmoslics_datas]
+		feature_counts = [[[cdata.get_feature_counts_avg(zbin, dim)._transform_map() for dim in [0, 1]] for zbin in self.zbins] for cdata in cosmoslics_datas]
 		# Axis=0 is the outermost [] in the list comprehension above
 		self.max_feature_count = np.max(feature_counts, axis=0)
 
@@ -163,8 +163,12 @@ class GrowingVectorCompressor(IndexCompressor):
 				x_ind_dim = self.indices[(self.indices[:, 0] == iz) * (self.indices[:, 1] == dim)][:, 3]
 				y_ind_dim = self.indices[(self.indices[:, 0] == iz) * (self.indices[:, 1] == dim)][:, 2]
 				
-				r = [-.05, .05]
-				pix_sc_map = BaseRangedMap(self.pixel_scores[iz][dim], x_range=r, y_range=r, dimension=dim, name='pixel_scores')
+				# Same axes as the BettiNumbersGrids, which can have quantile thresholds
+				bng = self.slics_data[0].zbins_bngs_avg[zbin][dim]
+				pix_sc_map = BaseRangedMap(
+					self.pixel_scores[iz][dim], x_range=bng.x_range, y_range=bng.y_range, dimension=dim, name='pixel_scores',
+					x_values=bng.x_values, y_values=bng.y_values
+				)
 
 				fig, ax = pix_sc_map.plot(title=f'Pixel scores zbin={zbin_lbl}, dim={dim}', scatter_points=[x_ind_dim, y_ind_dim],
 								scatters_are_index=True, heatmap_scatter_points=False)
@@ -0,0 +1,32 @@
+from typing import List
+
+import numpy as np
+
+from analysis.cosmology_data import CosmologyData
+from analysis.data_compression.persistence_summary import PersistenceSummaryCompressor
+from analysis.persistence_diagram import PersistenceDiagram
+
+
+class MinkowskiFunctionalsCompressor(PersistenceSummaryCompressor):
+	"""Data vectors of the area, boundary length and Euler characteristic of the excursion sets of the maps in every zbin.
+	These are calculated from the maps without persistence, so the PersistenceDiagrams must keep their maps (do_remember_maps in Pipeline).
+	"""
+
+	def __init__(self, cosmoslics_datas: List[CosmologyData], slics_data: List[CosmologyData], n_thresholds=20, functionals=(0, 1, 2)):
+		"""
+		:param n_thresholds: Number of thresholds in the data range of the maps
+		:param functionals: Indices of the functionals in the data vector, 0 is the area, 1 the boundary length and 2 the Euler characteristic
+		"""
+		self.n_thresholds = n_thresholds
+		self.functionals = list(functionals)
+		super().__init__(cosmoslics_datas, slics_data, name='minkowski_functionals')
+		self.thresholds = np.linspace(self.birth_range_dim[0][0], self.death_range_dim[0][1], n_thresholds)
+
+	def _summarize(self, pds: List[PersistenceDiagram]):
+		return np.array([perdi.get_minkowski_functionals(self.thresholds)[self.functionals] for perdi in pds])
+
+	def _build_summaries(self, cosm_data: CosmologyData):
+		# Minkowski functionals have no dimension, so there is one summary per zbin
+		return np.concatenate([
+			self._summarize(cosm_data.zbins_pds[zbin]).reshape((cosm_data.pds_count, -1)) for zbin in self.zbins
+		], axis=1)
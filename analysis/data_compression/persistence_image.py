@@ -0,0 +1,31 @@
+from typing import List
+
+import numpy as np
+
+from analysis.cosmology_data import CosmologyData
+from analysis.data_compression.persistence_summary import PersistenceSummaryCompressor
+from analysis.persistence_diagram import PersistenceDiagram
+from analysis.persistence_summaries import persistence_images
+from analysis.ragged_diagram import RaggedDiagram
+
+
+class PersistenceImageCompressor(PersistenceSummaryCompressor):
+	"""Data vectors of the persistence images of every zbin and dimension, averaged over the maps (regions) of a LOS."""
+
+	def __init__(self, cosmoslics_datas: List[CosmologyData], slics_data: List[CosmologyData], resolution=10, sigma=None):
+		"""
+		:param resolution: Number of pixels along each axis of the persistence images
+		:param sigma: Standard deviation of the Gaussians, see persistence_images
+		"""
+		self.resolution = resolution
+		self.sigma = sigma
+		super().__init__(cosmoslics_datas, slics_data, name='persistence_image')
+
+	def _summarize(self, pds: List[PersistenceDiagram], dim):
+		ragged = RaggedDiagram.from_arrays([perdi.dimension_pairs[dim] for perdi in pds])
+		images = persistence_images(
+			ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, self.birth_range_dim[dim],
+			[0, self.death_range_dim[dim][1] - self.birth_range_dim[dim][0]], resolution=self.resolution, sigma=self.sigma
+		)
+		# Per map, like the feature counts of NumberOfFeaturesCompressor
+		return images / np.array([perdi.maps_count for perdi in pds])[:, np.newaxis, np.newaxis]
@@ -0,0 +1,32 @@
+from typing import List
+
+import numpy as np
+
+from analysis.cosmology_data import CosmologyData
+from analysis.data_compression.persistence_summary import PersistenceSummaryCompressor
+from analysis.persistence_diagram import PersistenceDiagram
+from analysis.persistence_summaries import persistence_landscapes
+from analysis.ragged_diagram import RaggedDiagram
+
+
+class PersistenceLandscapeCompressor(PersistenceSummaryCompressor):
+	"""Data vectors of the first persistence landscapes of every zbin and dimension, averaged over the maps (regions) of a LOS."""
+
+	def __init__(self, cosmoslics_datas: List[CosmologyData], slics_data: List[CosmologyData], n_landscapes=3, n_thresholds=20):
+		"""
+		:param n_landscapes: Number of landscapes of every dimension
+		:param n_thresholds: Number of thresholds in the data range at which the landscapes are evaluated
+		"""
+		self.n_landscapes = n_landscapes
+		self.n_thresholds = n_thresholds
+		super().__init__(cosmoslics_datas, slics_data, name='persistence_landscape')
+
+	def _summarize(self, pds: List[PersistenceDiagram], dim):
+		# Landscapes are calculated for every map (region) and averaged, landscapes of the diagram of all maps together would mostly show the largest features
+		ragged = RaggedDiagram.from_arrays([perdi.region_pairs[dim][i] for perdi in pds for i in range(len(perdi.region_pairs[dim]))])
+
+		thresholds = np.linspace(self.birth_range_dim[dim][0], self.death_range_dim[dim][1], self.n_thresholds)
+		landscapes = persistence_landscapes(ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, thresholds, n_landscapes=self.n_landscapes)
+
+		maps_counts = [len(perdi.region_pairs[dim]) for perdi in pds]
+		return np.add.reduceat(landscapes, np.cumsum(maps_counts) - maps_counts, axis=0) / np.array(maps_counts)[:, np.newaxis, np.newaxis]
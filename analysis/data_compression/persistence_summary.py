@@ -0,0 +1,59 @@
+from typing import List
+
+import numpy as np
+
+from analysis.cosmology_data import CosmologyData
+from analysis.data_compression.compressor import Compressor
+from analysis.persistence_diagram import PersistenceDiagram
+
+
+class PersistenceSummaryCompressor(Compressor):
+	"""Compresses the persistence diagrams of every LOS into a summary, such as a persistence image, of both dimensions in every zbin.
+	The summaries of all LOS of one zbin are calculated at once from the concatenated diagrams.
+	The CosmologyDatas must hold their PersistenceDiagrams (zbins_pds). Subclasses must implement _summarize.
+	"""
+
+	def __init__(self, cosmoslics_datas: List[CosmologyData], slics_data: List[CosmologyData], name='persistence_summary'):
+		self.name = name
+		super().__init__(cosmoslics_datas, slics_data)
+
+		# All cosmologies use the data range of the BettiNumbersGrids, so the entries of their data vectors are comparable
+		self.birth_range_dim = [slics_data[0]._birth_range(dim) for dim in [0, 1]]
+		self.death_range_dim = [slics_data[0]._death_range(dim) for dim in [0, 1]]
+
+	def _summarize(self, pds: List[PersistenceDiagram], dim):
+		"""Summaries of dimension dim of every PersistenceDiagram. Must return an array with the summary of each PersistenceDiagram along the first axis."""
+		raise NotImplementedError
+
+	def _build_summaries(self, cosm_data: CosmologyData):
+		# Array of shape (n_los, data_vector_length), with the zbins and dimensions in the same order as the other compressors
+		return np.concatenate([
+			self._summarize(cosm_data.zbins_pds[zbin], dim).reshape((cosm_data.pds_count, -1))
+			for zbin in self.zbins for dim in [0, 1]
+		], axis=1)
+
+	def _build_training_set(self, cosm_datas: List[CosmologyData]):
+		training_set = {
+			'name': self.name,
+			'input': [],
+			'target': []
+		}
+		for cosmdata in cosm_datas:
+			# Average over all LOS
+			training_set['target'].append(np.average(self._build_summaries(cosmdata), axis=0))
+			training_set['input'].append(np.array([val for key, val in cosmdata.cosm_parameters.items() if key != 'id']))
+
+		training_set['input'] = np.array(training_set['input'])
+		return training_set
+
+	def _build_slics_training_set(self, slics_data: List[CosmologyData]):
+		sdata = slics_data[0]
+		training_set = {
+			'name': self.name,
+			'input': [],
+			'target': list(self._build_summaries(sdata))
+		}
+		for _ in range(sdata.pds_count):
+			training_set['input'].append(np.array([val for key, val in sdata.cosm_parameters.items() if key != 'id']))
+
+		return training_set
@@ -1,3 +1,5 @@
+import contextlib
+import io
 import os
 import re
 
@@ -5,63 +7,147 @@ import gudhi
 import matplotlib.pyplot as plt
 import numpy as np
 
+from analysis.cubical_persistence import cubical_persistence_pairs
+from analysis.minkowski_functionals import minkowski_functionals
+from analysis.smoothing import smooth_masked
 from utils import file_system
 
-def to_perseus_format(map, mask=None):
-	# Ref: https://gudhi.inria.fr/python/latest/fileformats.html#file-formats
 
-	output = '2\n'  # 2 dimensions
-	# Add shape lines
-	# First line is x length
-	output += str(map.shape[1]) + '\n'
-	# Second line is y length
-	output += str(map.shape[0]) + '\n'
+def parse_map_filename(filename):
+	"""
+	Determines cosmology, zbin, LOS and region of a map from its path, which ends in <cosmology directory>/<map file>.
+	"""
+	filename_without_folder = filename.split('/')[-1]
+	cosmology = filename.split('/')[-2]
 
-	masked_map = np.ma.array(map, mask=mask)
+	patt = re.compile('.+LOS([0-9]+)R([0-9]+).+')
+	mat = patt.match(filename_without_folder)
+
+	if 'Cosmol' in cosmology:
+		cosmology_id = cosmology.split('Cosmol')[-1]
+	else:
+		cosmology_id = 'SLICS'
+
+	zbin_patt = re.compile('((?:ZBcut[0-9.-]+)(?:_X_ZBcut[0-9.-]+)?)')
+	zbin_mat = zbin_patt.findall(cosmology)
+
+	return {
+		'filename_without_folder': filename_without_folder,
+		'cosmology': cosmology,
+		'cosmology_id': cosmology_id,
+		'zbin': zbin_mat[0],
+		'los': mat[1],
+		'region': mat[2]
+	}
+
+
+def _open_output(file, mode):
+	"""
+	Opens file when it is a path, a file or buffer is used as it is and left open.
+	"""
+	if isinstance(file, (str, os.PathLike)):
+		return open(file, mode)
+	return contextlib.nullcontext(file)
+
+
+def write_perseus(map, file, mask=None, chunk_rows=256):
+	"""
+	Writes a map in the Perseus cubical complex format, see https://gudhi.inria.fr/python/latest/fileformats.html#file-formats.
+	Values go from the bottom left to the top right, one per line, and masked pixels are empty lines.
+	gudhi does not read empty lines, maps with masked pixels set to inf can be written without a mask instead.
+	Every chunk of rows is formatted with one NumPy call and written at once.
+	:param file: Path, or text file or buffer to write to
+	:param mask: Boolean array of the shape of map, True for pixels to leave out, or None
+	:param chunk_rows: Number of rows formatted at once
+	"""
+	with _open_output(file, 'w') as output:
+		# Dimension, x length and y length
+		output.write(f'2\n{map.shape[1]}\n{map.shape[0]}\n')
+		rows = np.asarray(map)[::-1]
+		masked = np.asarray(mask)[::-1] if mask is not None else None
+		for start in range(0, len(rows), chunk_rows):
+			values = rows[start:start + chunk_rows].astype(str)
+			if masked is not None:
+				values[masked[start:start + chunk_rows]] = ''
+			output.write('\n'.join(values.ravel().tolist()) + '\n')
 
-	# Add values from bottom left to top right
-	for value in masked_map[::-1, :].flatten():
-		if value is np.ma.masked:
-			output += '\n'
-		else:
-			output += str(value) + '\n'
 
-	return output
+def to_perseus_format(map, mask=None):
+	# Ref: https://gudhi.inria.fr/python/latest/fileformats.html#file-formats
+	output = io.StringIO()
+	write_perseus(map, output, mask)
+	return output.getvalue()
+
+
+def write_dipha(map, file, mask=None):
+	"""
+	Writes a map in the binary DIPHA image format: the magic number 8067171840, the file type 1, the number of pixels,
+	the dimension and the x and y length as little-endian int64, followed by the values as little-endian float64.
+	Values are in the same order as write_perseus, masked pixels are inf so they enter last.
+	:param file: Path, or binary file or buffer to write to
+	:param mask: Boolean array of the shape of map, True for pixels to leave out, or None
+	"""
+	values = np.asarray(map, dtype='<f8')
+	if mask is not None:
+		values = np.where(mask, np.inf, values)
+	header = np.array([8067171840, 1, values.size, 2, map.shape[1], map.shape[0]], dtype='<i8')
+	with _open_output(file, 'wb') as output:
+		output.write(header.tobytes())
+		output.write(np.ascontiguousarray(values[::-1]).tobytes())
 
 
 class Map:
 
-	def __init__(self, filename=None, map=None, three_sigma_mask=False, lazy_load=False):
+	def __init__(self, filename=None, map=None, three_sigma_mask=False, lazy_load=False, keep_all_pairs=False, mmap=False, dtype=None, persistence_cache=None, persistence_filter=None, persistence_engine='gudhi', persistence_tile_size=None, persistence_tile_workers=1):
 		self.lazy_load = lazy_load
 		self.three_sigma_mask = three_sigma_mask
-		if map is None:
+		# Memory map the file copy-on-write instead of reading it into a private array
+		self.mmap = mmap
+		# dtype to calculate with, e.g. np.float32 to halve the memory of the map, None keeps the dtype of the file
+		self.dtype = dtype
+		# Whether dimension_pairs also contains an 'all' entry with the pairs of every dimension
+		self.keep_all_pairs = keep_all_pairs
+		# PersistenceCache to read the persistence pairs from instead of calculating them, only used for maps read from a file
+		self.persistence_cache = persistence_cache
+		# PersistenceFilter applied to the pairs, the cache holds the pairs before filtering
+		self.persistence_filter = persistence_filter
+		# 'gudhi' calculates the persistence with a gudhi.CubicalComplex, 'union_find' with cubical_persistence_pairs,
+		# which gives the same pairs in another order. The persistence cache is shared by both
+		if persistence_engine not in ['gudhi', 'union_find']:
+			raise ValueError(f'Unknown persistence_engine {persistence_engine}')
+		self.persistence_engine = persistence_engine
+		# Tiles of persistence_tile_size pixels reduced by persistence_tile_workers processes, see cubical_persistence_pairs.
+		# Only used by the 'union_find' engine, the pairs are the same for every tiling
+		if persistence_tile_size is not None and persistence_engine != 'union_find':
+			raise ValueError('persistence_tile_size is only supported by the union_find persistence_engine')
+		self.persistence_tile_size = persistence_tile_size
+		self.persistence_tile_workers = persistence_tile_workers
+		# Standard deviation in pixels of the Gaussian this map was smoothed with, see smooth
+		self.smoothing_scale = None
+		if map is None and filename is not None:
 			self.filename = filename
-			self.filename_without_folder = filename.split('/')[-1]
-			self.cosmology = filename.split('/')[-2]
-
-			patt = re.compile('.+LOS([0-9]+)R([0-9]+).+')
-			mat = patt.match(self.filename_without_folder)
 
-			self.region = mat[2]
-			self.los = mat[1]
-			
-			if 'Cosmol' in self.cosmology:
-				self.cosmology_id = self.cosmology.split('Cosmol')[-1]
-			else:
-				self.cosmology_id = 'SLICS'
-
-			zbin_patt = re.compile('((?:ZBcut[0-9.-]+)(?:_X_ZBcut[0-9.-]+)?)')
-			zbin_mat = zbin_patt.findall(self.cosmology)
-			self.zbin = zbin_mat[0]
+			map_info = parse_map_filename(filename)
+			self.filename_without_folder = map_info['filename_without_folder']
+			self.cosmology = map_info['cosmology']
+			self.region = map_info['region']
+			self.los = map_info['los']
+			self.cosmology_id = map_info['cosmology_id']
+			self.zbin = map_info['zbin']
 
 			if not lazy_load:
 				self._load()
-		elif filename is None:
+		elif filename is None and map is not None:
 			self.map = map
+		# Without filename and map the map is set later, e.g. by smooth
 
 	def __getattr__(self, item):
 		if item == 'lazy_load':
 			return super().__getattribute__('lazy_load')
+		# Persistence is calculated when it is first needed
+		if item == 'dimension_pairs':
+			self.get_persistence()
+			return self.dimension_pairs
 		# Just return if not lazy loading
 		if not self.lazy_load:
 			return super().__getattribute__(item)
@@ -69,15 +155,26 @@ class Map:
 		if item == 'map':
 			self._load()
 			return self.map
-		if item == 'dimension_pairs':
-			self.get_persistence()
-			return self.dimension_pairs
 		# Every other item can just be returned
 		return super().__getattribute__(item)
 
+	def __getstate__(self):
+		# gudhi complexes cannot be pickled, drop it so Maps can be sent between processes
+		state = self.__dict__.copy()
+		state.pop('cubical_complex', None)
+		return state
+
 	def _load(self):
-		self.map = np.load(self.filename)
+		if 'smoothing_source' in self.__dict__:
+			self._smooth_source()
+			return
+		# With a copy-on-write memory map, only the pages in which masked pixels are set to inf become private copies,
+		# the rest of the map is shared with the page cache
+		self.map = np.load(self.filename, mmap_mode='c' if self.mmap else None)
+		# Mask is found before changing dtype, so it does not depend on the precision
 		self._find_mask(three_sigma_mask=self.three_sigma_mask)
+		if self.dtype is not None and self.map.dtype != self.dtype:
+			self.map = self.map.astype(self.dtype)
 		self._apply_mask_set_inf()
 
 	def _find_mask(self, three_sigma_mask=False):
@@ -92,6 +189,13 @@ class Map:
 	def to_perseus_format(self):
 		return to_perseus_format(self.map, self.mask)
 
+	# Masked pixels are already inf, which gudhi and DIPHA read as pixels that enter last
+	def write_perseus(self, file):
+		write_perseus(self.map, file)
+
+	def write_dipha(self, file):
+		write_dipha(self.map, file)
+
 	def plot(self):
 		fig, ax = plt.subplots()
 		imax = ax.imshow(self.map)
@@ -106,37 +210,124 @@ class Map:
 		return self.cubical_complex
 	
 	def get_persistence(self):
-		if hasattr(self, 'persistence'):
-			return self.persistence
+		# Check __dict__ directly, hasattr would go through __getattr__ and calculate the persistence
+		if 'dimension_pairs' in self.__dict__:
+			return self.dimension_pairs
+
+		persistence_key = self.get_persistence_key()
+		cached_pairs = self.persistence_cache.get(persistence_key) if persistence_key is not None else None
+
+		if cached_pairs is not None:
+			self.dimension_pairs = cached_pairs
+			if self.keep_all_pairs:
+				self.dimension_pairs['all'] = np.concatenate([self.dimension_pairs[dimension] for dimension in [0, 1]])
+		else:
+			if self.persistence_engine == 'gudhi':
+				if not hasattr(self, 'cubical_complex'):
+					self._to_cubical_complex()
+				# Does not build gudhi's Python list of (dimension, (birth, death)) tuples, the pairs are read per dimension
+				self.cubical_complex.compute_persistence()
+			self._separate_persistence_dimensions()
+
+			if persistence_key is not None:
+				self.persistence_cache.put(persistence_key, self.dimension_pairs)
 
-		if not hasattr(self, 'cubical_complex'):
-			self._to_cubical_complex()
-		self.persistence = self.cubical_complex.persistence()
 		self._filter_persistence()
-		self._separate_persistence_dimensions()
-		return self.persistence
+		return self.dimension_pairs
+
+	def get_persistence_key(self):
+		"""
+		Key of this map in the persistence cache, depends on the contents of the map file and on the options
+		that change the persistence. None when there is no cache or the map was not read from a file.
+		"""
+		if self.persistence_cache is None or 'filename' not in self.__dict__:
+			return None
+		options = {
+			'three_sigma_mask': bool(self.three_sigma_mask),
+			'dtype': np.dtype(self.dtype).name if self.dtype is not None else None
+		}
+		# Only smoothed maps have the scale in their key, so the keys of other maps stay the same
+		if self.smoothing_scale is not None:
+			options['smoothing_scale'] = float(self.smoothing_scale)
+		return self.persistence_cache.key(self.filename, options)
 	
 	def _filter_persistence(self):
-		pass
+		if self.persistence_filter is None:
+			return
+		self.dimension_pairs, self.removed_pairs_count = self.persistence_filter.apply(self.dimension_pairs)
+
+	def get_persistence_filter_config(self):
+		return None if self.persistence_filter is None else self.persistence_filter.config()
 	
 	def _separate_persistence_dimensions(self):
-		# Persistence is list of (dimension, (birth, death))
+		if self.persistence_engine == 'union_find':
+			# Arrays of (birth, death) pairs for each dimension, without building a complex
+			self.dimension_pairs = cubical_persistence_pairs(
+				self.map, tile_size=self.persistence_tile_size, n_workers=self.persistence_tile_workers
+			)
+		else:
+			# Arrays of (birth, death) pairs for each dimension, straight from gudhi
+			self.dimension_pairs = {
+				dimension: self.cubical_complex.persistence_intervals_in_dimension(dimension).reshape((-1, 2))
+				for dimension in [0, 1]
+			}
 
-		# Create lists of (birth, death) pairs for each dimension
-		dimension_pairs = {
-			'all': []
-		}
-		for (dimension, pair) in self.persistence:
-			if dimension not in dimension_pairs:
-				dimension_pairs[dimension] = [pair]
-			else:
-				dimension_pairs[dimension].append(pair)
-			
-			dimension_pairs['all'].append(pair)
-		
-		self.dimension_pairs = {dimension: np.array(dimension_pairs[dimension]) for dimension in dimension_pairs}
+		if self.keep_all_pairs:
+			self.dimension_pairs['all'] = np.concatenate([self.dimension_pairs[dimension] for dimension in [0, 1]])
 	
 	def get_betti_numbers(self):
 		self.get_persistence()
-		self.betti_numbers = self.cubical_complex.betti_numbers()
+		if self.persistence_engine == 'union_find':
+			# Like gudhi, the Betti numbers of the complex with all pixels, which is a filled rectangle
+			self.betti_numbers = [1, 0, 0]
+		else:
+			self.betti_numbers = self.cubical_complex.betti_numbers()
 		return self.betti_numbers
+
+	def smooth(self, scales, lazy_load=False):
+		"""
+		Smooths the map with a Gaussian of every scale, all scales at once with FFTs. See smooth_masked,
+		masked pixels do not contribute and stay masked.
+		:param scales: Standard deviations of the Gaussians in pixels
+		:param lazy_load: Whether to only smooth when the map of one of the returned Maps is first needed, e.g. when its persistence
+			is not in the cache. All scales are smoothed then
+		:return: List with a Map for every scale, with the file information and options of this map.
+			Maps read from a file have their persistence cached per scale
+		"""
+		maps = []
+		for scale in scales:
+			smoothed_map = Map(
+				three_sigma_mask=self.three_sigma_mask, lazy_load=lazy_load, keep_all_pairs=self.keep_all_pairs, dtype=self.dtype,
+				persistence_cache=self.persistence_cache, persistence_filter=self.persistence_filter, persistence_engine=self.persistence_engine,
+				persistence_tile_size=self.persistence_tile_size, persistence_tile_workers=self.persistence_tile_workers
+			)
+			smoothed_map.smoothing_scale = scale
+			for item in ['filename', 'filename_without_folder', 'cosmology', 'region', 'los', 'cosmology_id', 'zbin']:
+				if item in self.__dict__:
+					setattr(smoothed_map, item, self.__dict__[item])
+			# Map to smooth and the Maps of all scales, which are smoothed together
+			smoothed_map.smoothing_source = (self, maps)
+			maps.append(smoothed_map)
+
+		if not lazy_load:
+			maps[0]._load()
+		return maps
+
+	def _smooth_source(self):
+		source, maps = self.smoothing_source
+		smoothed = smooth_masked(source.map, source.mask, [map.smoothing_scale for map in maps])
+		if self.dtype is not None:
+			smoothed = smoothed.astype(self.dtype)
+		for map, smoothed_map in zip(maps, smoothed):
+			map.map = smoothed_map
+			map.mask = source.mask
+			# The map that was smoothed is not kept alive by the smoothed Maps
+			del map.smoothing_source
+
+	def get_minkowski_functionals(self, thresholds):
+		"""
+		Area, boundary length and Euler characteristic of the excursion sets of the map, see minkowski_functionals.
+		Does not need the persistence.
+		:param thresholds: Ascending thresholds of the excursion sets
+		"""
+		return minkowski_functionals(self.map, thresholds)
@@ -0,0 +1,130 @@
+import fnmatch
+import gzip
+import json
+import os
+
+import pandas as pd
+
+from analysis.map import parse_map_filename
+from utils import file_system
+
+
+class MapManifest:
+	"""
+	Index of all maps in maps_dir, built by scanning the directory once.
+	Every row holds the path, cosmology, zbin, LOS and region of one map, so finding maps is a query on this index
+	instead of a glob call on the (slow, networked) filesystem.
+	"""
+
+	# Same names as the glob patterns in Pipeline
+	dir_pattern = 'MRres140.64arcs_100Sqdeg_SN*_Mosaic_KiDS1000GpAM_zKiDS1000_*'
+	file_pattern = 'SN0*LOS*R*.S*.npy'
+
+	def __init__(self, maps_dir, index: pd.DataFrame, dir_mtimes=None):
+		self.maps_dir = maps_dir
+		self.index = index
+		# Modification time of every cosmology/zbin directory when it was scanned, which changes when maps are added or removed
+		self.dir_mtimes = dir_mtimes if dir_mtimes is not None else {}
+
+	@classmethod
+	def _get_dir_mtimes(cls, maps_dir):
+		# One listing of maps_dir and one stat per cosmology/zbin directory
+		return {
+			dir_entry.name: dir_entry.stat().st_mtime_ns for dir_entry in os.scandir(maps_dir)
+			if dir_entry.is_dir() and fnmatch.fnmatchcase(dir_entry.name, cls.dir_pattern)
+		}
+
+	@classmethod
+	def _scan_dir(cls, maps_dir, dir_name):
+		rows = []
+		# One directory listing per cosmology/zbin directory
+		for file_entry in os.scandir(os.path.join(maps_dir, dir_name)):
+			if not fnmatch.fnmatchcase(file_entry.name, cls.file_pattern):
+				continue
+
+			map_info = parse_map_filename(f'{dir_name}/{file_entry.name}')
+			rows.append({
+				# Relative to maps_dir
+				'path': f'{dir_name}/{file_entry.name}',
+				# Cosmology names as used in Pipeline.cosmologies
+				'cosmology': 'SLICS' if map_info['cosmology_id'] == 'SLICS' else f'Cosmol{map_info["cosmology_id"]}',
+				'zbin': map_info['zbin'],
+				'los': int(map_info['los']),
+				'region': int(map_info['region'])
+			})
+		return rows
+
+	@staticmethod
+	def _sorted_index(index: pd.DataFrame):
+		return index.sort_values(['cosmology', 'zbin', 'los', 'region'], ignore_index=True)
+
+	@classmethod
+	def build(cls, maps_dir):
+		dir_mtimes = cls._get_dir_mtimes(maps_dir)
+		rows = [row for dir_name in dir_mtimes for row in cls._scan_dir(maps_dir, dir_name)]
+		index = pd.DataFrame(rows, columns=['path', 'cosmology', 'zbin', 'los', 'region'])
+		return cls(maps_dir, cls._sorted_index(index), dir_mtimes)
+
+	def update(self):
+		"""
+		Scans the cosmology/zbin directories again that were added or modified since they were scanned, and drops those that were removed.
+		:return: Whether the index changed
+		"""
+		dir_mtimes = self._get_dir_mtimes(self.maps_dir)
+		changed_dirs = [dir_name for dir_name, mtime in dir_mtimes.items() if self.dir_mtimes.get(dir_name) != mtime]
+		removed_dirs = [dir_name for dir_name in self.dir_mtimes if dir_name not in dir_mtimes]
+		if len(changed_dirs) == 0 and len(removed_dirs) == 0:
+			return False
+
+		kept = ~self.index.path.str.split('/').str[0].isin(changed_dirs + removed_dirs)
+		rows = [row for dir_name in changed_dirs for row in self._scan_dir(self.maps_dir, dir_name)]
+		self.index = self._sorted_index(pd.concat(
+			[self.index[kept], pd.DataFrame(rows, columns=['path', 'cosmology', 'zbin', 'los', 'region'])], ignore_index=True
+		))
+		self.dir_mtimes = dir_mtimes
+		return True
+
+	def save(self, path):
+		file_system.check_folder_exists(os.path.dirname(path) or '.')
+		with gzip.open(path, 'wt') as file:
+			json.dump({'maps_dir': self.maps_dir, 'index': self.index.to_dict('list'), 'dir_mtimes': self.dir_mtimes}, file)
+
+	@classmethod
+	def load(cls, path):
+		with gzip.open(path, 'rt') as file:
+			manifest = json.load(file)
+		# Manifests saved without directory modification times are scanned again completely by update
+		return cls(
+			manifest['maps_dir'], pd.DataFrame(manifest['index'], columns=['path', 'cosmology', 'zbin', 'los', 'region']), manifest.get('dir_mtimes')
+		)
+
+	@classmethod
+	def load_or_build(cls, maps_dir, path, rebuild=False):
+		"""
+		Loads the manifest saved at path, the maps_dir is scanned (and the manifest saved) when there is no manifest yet,
+		when it belongs to a different maps_dir or when rebuild is set. A loaded manifest is updated with the directories that changed.
+		"""
+		if not rebuild and os.path.exists(path):
+			manifest = cls.load(path)
+			if manifest.maps_dir == maps_dir:
+				if manifest.update():
+					manifest.save(path)
+				return manifest
+
+		manifest = cls.build(maps_dir)
+		manifest.save(path)
+		return manifest
+
+	def query(self, cosmology='*', zbin='*', los='*', region='*'):
+		"""
+		Selects the maps matching all filters, the filters are glob patterns like the Pipeline filter_* options.
+		:return: DataFrame with the matching rows, path is joined with maps_dir
+		"""
+		selection = pd.Series(True, index=self.index.index)
+		for column, pattern in zip(['cosmology', 'zbin', 'los', 'region'], [cosmology, zbin, los, region]):
+			if str(pattern) != '*':
+				selection &= self.index[column].astype(str).str.match(fnmatch.translate(str(pattern)))
+
+		result = self.index[selection].copy()
+		result['path'] = [os.path.join(self.maps_dir, path) for path in result['path']]
+		return result
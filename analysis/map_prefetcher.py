@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from analysis.map import Map
+
+
+class MapPrefetcher:
+	"""
+	Iterates over groups of map paths (e.g. the regions of one LOS) and yields the loaded Maps of every group.
+	While a group is being processed, the next `depth` groups are read on background threads, so reading maps
+	overlaps with calculating persistence instead of alternating with it.
+	"""
+
+	def __init__(self, groups: List[List[str]], map_kwargs=None, depth=2, n_threads=4, prefetch: List[bool]=None):
+		"""
+		:param prefetch: Whether the maps of every group are read ahead, None reads all groups.
+			Lazily loaded maps of the other groups are not read, e.g. when the products of the group are reused
+		"""
+		self.groups = groups
+		self.prefetch = prefetch
+		self.map_kwargs = map_kwargs if map_kwargs is not None else {}
+		self.depth = depth
+		self.n_threads = n_threads
+
+		# Time spent reading maps on the background threads
+		self.io_time = 0.
+		# Time the consumer waited for maps that were not read yet
+		self.wait_time = 0.
+		self.maps_count = 0
+		self._lock = threading.Lock()
+
+	@property
+	def hidden_io_time(self):
+		# Reading time that overlapped with processing
+		return max(0., self.io_time - self.wait_time)
+
+	def _load_map(self, map_path, prefetch=True):
+		start = time.perf_counter()
+		map = Map(map_path, **self.map_kwargs)
+		if not prefetch:
+			return map
+		# Lazy maps are only read when the map is first needed, force it here
+		if map.lazy_load:
+			map._load()
+		elapsed = time.perf_counter() - start
+
+		with self._lock:
+			self.io_time += elapsed
+			self.maps_count += 1
+		return map
+
+	def __iter__(self):
+		with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+			groups = iter(zip(self.groups, self.prefetch if self.prefetch is not None else [True] * len(self.groups)))
+			pending = deque()
+
+			def submit_next():
+				group, prefetch = next(groups, (None, None))
+				if group is not None:
+					pending.append([executor.submit(self._load_map, map_path, prefetch) for map_path in group])
+
+			# Keep at most depth groups read ahead
+			for _ in range(max(1, self.depth)):
+				submit_next()
+
+			while len(pending) > 0:
+				futures = pending.popleft()
+				submit_next()
+
+				start = time.perf_counter()
+				maps = [future.result() for future in futures]
+				self.wait_time += time.perf_counter() - start
+
+				yield maps
+
+	def summary(self):
+		return f'Read {self.maps_count} maps in {self.io_time:.1f}s, waited {self.wait_time:.1f}s, {self.hidden_io_time:.1f}s of reading was hidden'
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def _count_at_least(values: np.ndarray, thresholds: np.ndarray):
+	"""
+	Number of values >= every threshold, the values are binned once between the ascending thresholds.
+	"""
+	index = np.searchsorted(thresholds, values.ravel(), side='right')
+	return np.cumsum(np.bincount(index, minlength=len(thresholds) + 1)[::-1])[::-1][1:]
+
+
+def minkowski_functionals(map: np.ndarray, thresholds: np.ndarray):
+	"""
+	Minkowski functionals of the excursion sets of a 2D map, the pixels with a value >= threshold, for every threshold.
+	The excursion set is the union of its closed pixels, like a gudhi.CubicalComplex of the map. Every vertex, edge and pixel
+	enters at the largest value of the pixels it belongs to, so counting them for all thresholds takes one pass over the map.
+	Masked pixels are not finite (inf in Map), they are never in an excursion set and their sides are no boundary.
+	:param thresholds: Ascending thresholds
+	:return: Array of shape (3, len(thresholds)) with the area, the boundary length (in pixel sides)
+		and the Euler characteristic, per unmasked pixel
+	"""
+	values = np.asarray(map, dtype=np.float64)
+	observed = np.isfinite(values)
+	padded = np.pad(np.where(observed, values, -np.inf), 1, constant_values=-np.inf)
+
+	pixels = padded[1:-1, 1:-1]
+	# Edges between two rows and between two columns of pixels, and vertices between four pixels
+	row_edges = np.maximum(padded[:-1, 1:-1], padded[1:, 1:-1])
+	column_edges = np.maximum(padded[1:-1, :-1], padded[1:-1, 1:])
+	vertices = np.maximum(np.maximum(padded[:-1, :-1], padded[:-1, 1:]), np.maximum(padded[1:, :-1], padded[1:, 1:]))
+
+	area = _count_at_least(pixels, thresholds)
+	euler_characteristic = _count_at_least(vertices, thresholds) - _count_at_least(row_edges, thresholds) \
+		- _count_at_least(column_edges, thresholds) + area
+
+	# A side between two unmasked pixels is boundary when only the largest of the two is in the excursion set
+	sides = [(values[:-1, :], values[1:, :]), (values[:, :-1], values[:, 1:])]
+	boundary = np.zeros(len(thresholds), dtype=np.int64)
+	for a, b in sides:
+		both_observed = np.isfinite(a) & np.isfinite(b)
+		a, b = a[both_observed], b[both_observed]
+		boundary += _count_at_least(np.maximum(a, b), thresholds) - _count_at_least(np.minimum(a, b), thresholds)
+
+	return np.array([area, boundary, euler_characteristic]) / max(np.sum(observed), 1)
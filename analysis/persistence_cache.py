@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class PersistenceCache:
+	"""
+	Cache of the persistence pairs of single maps, stored in cache_dir under a key that is the hash of the map file
+	contents and the options that change the persistence (e.g. the mask). A changed map file or option gives a new key,
+	so only the entries of that map are calculated again and a stale entry is never returned.
+	"""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		# Hashes of files by (path, size, modification time), read from file_hashes.jsonl in cache_dir when first needed.
+		# New hashes are appended to it, so a file is only hashed again when it changed, also in other processes and later runs
+		self._file_hashes = None
+		self.hits = 0
+		self.misses = 0
+
+	def __getstate__(self):
+		# Worker processes read the hashes from the file, which also has the hashes of the other processes
+		state = self.__dict__.copy()
+		state['_file_hashes'] = None
+		return state
+
+	def _file_hashes_path(self):
+		return os.path.join(self.cache_dir, 'file_hashes.jsonl')
+
+	def _load_file_hashes(self):
+		self._file_hashes = {}
+		if not os.path.exists(self._file_hashes_path()):
+			return
+		with open(self._file_hashes_path()) as file:
+			for line in file:
+				try:
+					path, size, mtime, file_hash = json.loads(line)
+				except ValueError:
+					# Line that another process is still writing
+					continue
+				self._file_hashes[(path, size, mtime)] = file_hash
+
+	def file_hash(self, filename):
+		if self._file_hashes is None:
+			self._load_file_hashes()
+
+		stat = os.stat(filename)
+		file_id = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+		if file_id not in self._file_hashes:
+			sha = hashlib.sha1()
+			with open(filename, 'rb') as file:
+				for chunk in iter(lambda: file.read(1 << 20), b''):
+					sha.update(chunk)
+			self._file_hashes[file_id] = sha.hexdigest()
+
+			os.makedirs(self.cache_dir, exist_ok=True)
+			# One short append per hash, which other processes appending to the same file do not interleave with
+			with open(self._file_hashes_path(), 'a') as file:
+				file.write(json.dumps([*file_id, self._file_hashes[file_id]]) + '\n')
+		return self._file_hashes[file_id]
+
+	def key(self, filename, options):
+		"""
+		:param filename: Path of the map file
+		:param options: Dictionary with the options the persistence depends on, must be JSON serializable
+		"""
+		sha = hashlib.sha1(self.file_hash(filename).encode())
+		sha.update(json.dumps(options, sort_keys=True).encode())
+		return sha.hexdigest()
+
+	def _path(self, key):
+		# Split over subdirectories, to keep the number of files per directory low
+		return os.path.join(self.cache_dir, key[:2], f'{key}.npz')
+
+	def get(self, key):
+		"""
+		:return: Dictionary with the pairs of each dimension, None if key is not in the cache
+		"""
+		path = self._path(key)
+		if not os.path.exists(path):
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		with np.load(path) as cached:
+			return {dim: cached[f'dimension_pairs_{dim}'] for dim in [0, 1]}
+
+	def put(self, key, dimension_pairs):
+		path = self._path(key)
+		# exist_ok, other processes may create the same directory at the same time
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		# Written to a temporary file first, so other processes never read a half written entry
+		tmp_path = f'{path}.{os.getpid()}.tmp'
+		with open(tmp_path, 'wb') as file:
+			np.savez(file, **{f'dimension_pairs_{dim}': dimension_pairs[dim] for dim in [0, 1]})
+		os.replace(tmp_path, path)
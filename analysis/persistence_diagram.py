@@ -1,18 +1,28 @@
+import json
 import os
 from typing import Union, List
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+from analysis.betti_numbers import batched_persistent_betti_numbers, multi_resolution_persistent_betti_numbers, persistent_betti_numbers
+from analysis.betti_numbers import thresholds_resolution, triangle_indices, triangle_to_grid
+from analysis.betti_number_index import BettiNumberIndex
 from analysis.map import Map
+from analysis.ragged_diagram import RaggedDiagram
+from analysis.smoothing import gaussian_smooth
 import analysis.cosmologies as cosmologies
 from utils import file_system
 
 class PersistenceDiagram:
 
-	def __init__(self, maps: List[Map], cosmology=None, do_delete_maps=False, lazy_load=False, recalculate=False, plots_dir='plots', products_dir='products'):
+	def __init__(self, maps: List[Map], cosmology=None, do_delete_maps=False, lazy_load=False, recalculate=False, plots_dir='plots', products_dir='products', product_store=None):
 		self.lazy_load = lazy_load
 		self.recalculate = recalculate
+		# With a ProductStore the products are not saved as .npy files, the caller writes them with ProductStore.write
+		self.product_store = product_store
+		# (cosmology, zbin, LOS index) of the pairs in the ProductStore, see set_product_store_location
+		self.product_store_location = None
 
 		if cosmology is None:
 			self.cosmology = maps[0].cosmology
@@ -39,69 +49,201 @@ class PersistenceDiagram:
 		self.set_products_loc(products_dir)
 		self.set_plots_loc(plots_dir)
 
+		self._set_cosmological_parameters()
+
+		self.handle_maps(maps, do_delete_maps)
+
+	@classmethod
+	def from_product_store(cls, product_store, cosmology, zbin, products, los_index, lazy_load=False, plots_dir='plots', products_dir='products'):
+		"""
+		Creates the PersistenceDiagram of one LOS from its products in a ProductStore, without reading any maps.
+		:param products: Products of the cosmology in the zbin, as returned by ProductStore.read
+		:param los_index: Position of the LOS in products
+		"""
+		perdi = cls.__new__(cls)
+		perdi.lazy_load = lazy_load
+		perdi.recalculate = False
+		perdi.product_store = product_store
+
+		perdi.cosmology = products['cosmology']
+		perdi.cosmology_id = products['cosmology_id']
+		perdi.zbin = zbin
+		perdi.los = products['los'][los_index]
+		perdi.set_products_loc(products_dir)
+		perdi.set_plots_loc(plots_dir)
+		perdi._set_cosmological_parameters()
+
+		perdi.maps_count = products['maps_count'][los_index]
+		first_region = np.sum(products['maps_count'][:los_index])
+		last_region = first_region + perdi.maps_count
+		perdi.map_names = products['map_names'][first_region:last_region]
+		perdi.map_keys = products['map_keys'][first_region:last_region] if products['map_keys'] is not None else None
+		perdi.dimension_pairs_count = np.array([
+			products['region_offsets'][dim][last_region] - products['region_offsets'][dim][first_region] for dim in [0, 1]
+		], dtype=float)
+
+		perdi.persistence_filter_config = products['persistence_filter']
+		perdi.product_store_location = (cosmology, zbin, los_index)
+		if not lazy_load:
+			if 'region_pairs' in products:
+				perdi.region_pairs = {}
+				for dim in [0, 1]:
+					region_offsets = products['region_offsets'][dim][first_region:last_region + 1]
+					perdi.region_pairs[dim] = RaggedDiagram(
+						products['region_pairs'][dim].pairs[region_offsets[0]:region_offsets[-1]], region_offsets - region_offsets[0]
+					)
+				perdi.dimension_pairs = {dim: perdi.region_pairs[dim].pairs for dim in [0, 1]}
+			else:
+				perdi._load('region_pairs')
+
+		return perdi
+
+	def _set_cosmological_parameters(self):
 		self.cosm_parameters_full = cosmologies.get_cosmological_parameters(self.cosmology_id).to_dict('records')[0]
 		self.cosm_parameters = cosmologies.get_cosmological_parameters(self.cosmology_id)[['id', 'Omega_m', 'S_8', 'h', 'w_0']].to_dict('records')[0]
 
-		self.handle_maps(maps, do_delete_maps)
+	def set_product_store_location(self, cosmology, los_index):
+		"""
+		Sets where the pairs of this PersistenceDiagram are in its ProductStore, once they have been written there.
+		When lazy loading, the pairs are then dropped from memory and read from the ProductStore when needed.
+		"""
+		self.product_store_location = (cosmology, self.zbin, los_index)
+		if self.lazy_load:
+			self.release_pairs()
+
+	def release_pairs(self):
+		# Lazy loaded pairs are read again when they are needed
+		self.__dict__.pop('dimension_pairs', None)
+		self.__dict__.pop('region_pairs', None)
 
 	def set_plots_loc(self, plots_loc):
 		self.plot_loc = os.path.join(plots_loc, 'persistence_diagrams', self.zbin, f'Cosmol{self.cosmology_id}', f'LOS{self.los}')
 
 	def set_products_loc(self, products_loc):
 		self.product_loc = os.path.join(products_loc, 'persistence_diagrams', self.zbin, f'Cosmol{self.cosmology_id}', f'LOS{self.los}')
-		file_system.check_folder_exists(self.product_loc)
+		# Products in a ProductStore do not need a directory for every LOS
+		if self.product_store is None:
+			file_system.check_folder_exists(self.product_loc)
 
 	def handle_maps(self, maps, do_delete_maps):
 		self.maps_count = len(maps)
 		self.maps = maps
-
-		# Recalculate when one of products don't exist
-		if not (
-				os.path.exists(os.path.join(self.product_loc, 'dimension_pairs_0.npy'))
-				and
-				os.path.exists(os.path.join(self.product_loc, 'dimension_pairs_1.npy'))
-			) or self.recalculate:
-
+		# File names of the maps, maps created from an array have none
+		self.map_names = [getattr(map, 'filename_without_folder', '') for map in maps]
+
+		# Persistence cache keys of the maps, the products are stale when they were made from other maps or options
+		map_keys = [map.get_persistence_key() for map in maps]
+		check_map_keys = len(maps) > 0 and None not in map_keys
+		self.map_keys = map_keys if check_map_keys else None
+		# Settings of the PersistenceFilter of the maps, the products are stale when they were filtered differently
+		filter_config = maps[0].get_persistence_filter_config() if len(maps) > 0 else None
+		self.persistence_filter_config = filter_config
+
+		if self._products_stale(maps, map_keys, filter_config):
 			if len(maps) > 0:
-				self.dimension_pairs = maps[0].dimension_pairs.copy()
-				self.dimension_pairs_count = np.zeros(2)				
-
-				self.dimension_pairs_list = []
+				self.dimension_pairs = {}
+				# The pairs of every dimension per map (region), see RaggedDiagram
+				self.region_pairs = {}
+				self.dimension_pairs_count = np.zeros(2)
 
-				for map in maps[1:]:
-					self.dimension_pairs_list.append(map.dimension_pairs)
-					for dimension in self.dimension_pairs:
-						self.dimension_pairs[dimension] = np.append(self.dimension_pairs[dimension], map.dimension_pairs[dimension], axis=0)
-				
-				del self.dimension_pairs['all']
+				for dim in [0, 1]:
+					# Concatenate the pairs of all maps at once, instead of growing one array for every map
+					region_pairs = RaggedDiagram.from_arrays([map.dimension_pairs[dim] for map in maps])
 
-				for dim in self.dimension_pairs:
 					# np.min collapses the isfinite check to cover the pair of values instead of only one coordinate
-					self.dimension_pairs[dim] = self.dimension_pairs[dim][np.min(np.isfinite(self.dimension_pairs[dim]), axis=1)]
+					self.region_pairs[dim] = region_pairs.filter(np.min(np.isfinite(region_pairs.pairs), axis=1))
+					self.dimension_pairs[dim] = self.region_pairs[dim].pairs
 					self.dimension_pairs_count[dim] = self.dimension_pairs[dim].shape[0]
 
-					# Save dimension pairs to products
-					np.save(os.path.join(self.product_loc, f'dimension_pairs_{dim}.npy'), self.dimension_pairs[dim])
+				# Number of pairs removed by the PersistenceFilter in each dimension
+				if filter_config is not None:
+					self.removed_pairs_count = np.sum([[map.removed_pairs_count[dim] for dim in [0, 1]] for map in maps], axis=0)
 
-				np.save(os.path.join(self.product_loc, 'dimension_pairs_count.npy'), self.dimension_pairs_count)
+				if self.product_store is None:
+					self._save_pairs(map_keys if check_map_keys else None, filter_config)
 
-			if self.lazy_load:
+			# Pairs for a ProductStore are kept until they are written, see set_product_store_location
+			if self.lazy_load and self.product_store is None:
 				del self.dimension_pairs
+				del self.region_pairs
 		elif not self.lazy_load:
-			self._load()
+			self._load('dimension_pairs')
+			self._load('dimension_pairs_count')
 
 		if do_delete_maps:
 			del self.maps
 
+	def _products_stale(self, maps, map_keys, filter_config):
+		check_map_keys = len(maps) > 0 and None not in map_keys
+		# Recalculate when one of products don't exist, products in a ProductStore are always calculated
+		return self.product_store is not None or not (
+				os.path.exists(os.path.join(self.product_loc, 'dimension_pairs_0.npy'))
+				and
+				os.path.exists(os.path.join(self.product_loc, 'dimension_pairs_1.npy'))
+			) or self.recalculate or (check_map_keys and self._load_json('map_keys.json') != map_keys) \
+				or (len(maps) > 0 and self._load_json('persistence_filter.json') != filter_config)
+
+	@classmethod
+	def needs_maps(cls, maps: List[Map], recalculate=False, products_dir='products', product_store=None):
+		"""
+		Whether creating the PersistenceDiagram of maps calculates the persistence of the maps, instead of loading its products.
+		Lazily loaded maps are not read.
+		"""
+		perdi = cls.__new__(cls)
+		perdi.recalculate = recalculate
+		perdi.product_store = product_store
+		perdi.zbin = maps[0].zbin
+		perdi.cosmology_id = maps[0].cosmology_id
+		perdi.los = maps[0].los
+		perdi.set_products_loc(products_dir)
+		filter_config = maps[0].get_persistence_filter_config()
+		return perdi._products_stale(maps, [map.get_persistence_key() for map in maps], filter_config)
+
+	def _save_pairs(self, map_keys=None, filter_config=None):
+		for dim in [0, 1]:
+			np.save(os.path.join(self.product_loc, f'dimension_pairs_{dim}.npy'), self.dimension_pairs[dim])
+
+		np.save(os.path.join(self.product_loc, 'dimension_pairs_count.npy'), self.dimension_pairs_count)
+		np.save(os.path.join(self.product_loc, 'region_offsets.npy'), [self.region_pairs[dim].offsets for dim in [0, 1]])
+
+		if map_keys is not None:
+			with open(os.path.join(self.product_loc, 'map_keys.json'), 'w') as file:
+				json.dump(map_keys, file)
+
+		filter_config_path = os.path.join(self.product_loc, 'persistence_filter.json')
+		if filter_config is not None:
+			with open(filter_config_path, 'w') as file:
+				json.dump(filter_config, file)
+		elif os.path.exists(filter_config_path):
+			os.remove(filter_config_path)
+
+	def _load_json(self, name):
+		# None when the product does not exist
+		path = os.path.join(self.product_loc, name)
+		if not os.path.exists(path):
+			return None
+		with open(path) as file:
+			return json.load(file)
+
 	def _load(self, item):
-		if item == 'dimension_pairs':
+		if self.product_store_location is not None and item in ['dimension_pairs', 'region_pairs']:
+			self.region_pairs = self.product_store.read_los_pairs(*self.product_store_location)
+			self.dimension_pairs = {dim: self.region_pairs[dim].pairs for dim in [0, 1]}
+		elif item == 'dimension_pairs':
 			self.dimension_pairs = {dim: np.load(os.path.join(self.product_loc, f'dimension_pairs_{dim}.npy')) for dim in [0, 1]}
 		elif item == 'dimension_pairs_count':
 			self.dimension_pairs_count = np.load(os.path.join(self.product_loc, 'dimension_pairs_count.npy'))
+		elif item == 'region_pairs':
+			region_offsets = np.load(os.path.join(self.product_loc, 'region_offsets.npy'))
+			self.region_pairs = {dim: RaggedDiagram(self.dimension_pairs[dim], region_offsets[dim]) for dim in [0, 1]}
 
 	def __getattr__(self, item):
 		if item == 'lazy_load':
 			return super().__getattribute__('lazy_load')
+		# Pairs per region are only read when they are needed, also when the diagram was loaded from its products
+		if item == 'region_pairs':
+			self._load('region_pairs')
+			return self.region_pairs
 		# Just return if not lazy loading
 		if not self.lazy_load:
 			return super().__getattribute__(item)
@@ -113,6 +255,7 @@ class PersistenceDiagram:
 		if item == 'dimension_pairs_count':
 			self._load('dimension_pairs_count')
 			return self.dimension_pairs_count
+
 		# Every other item can just be returned
 		return super().__getattribute__(item)
 
@@ -166,11 +309,19 @@ class PersistenceDiagram:
 		self.ax.axvline(x=all_maps_avg, linestyle='--', color='grey')
 		self.ax.axhline(y=all_maps_avg, linestyle='--', color='grey')
 
-	def get_persistent_betti_numbers(self, birth_before: np.ndarray, death_after: np.ndarray, dimension):
-
-		# Count the number of scatter points that have birth < birth_before and death > death_after
+	def get_persistent_betti_numbers(self, birth_before: np.ndarray, death_after: np.ndarray, dimension, engine='histogram'):
+		"""
+		Count the number of scatter points that have birth < birth_before and death > death_after.
+		:param engine: 'histogram' bins the features once and uses cumulative sums, 'broadcast' compares every feature
+			with every grid point, which needs (R, R, N) temporary arrays
+		"""
 		pairs = self.dimension_pairs[dimension]
 
+		if engine == 'histogram':
+			return persistent_betti_numbers(pairs[:, 0], pairs[:, 1], birth_before, death_after)
+		elif engine != 'broadcast':
+			raise ValueError(f'Unknown engine {engine}')
+
 		number_of_features = pairs.shape[0]
 		number_of_test_coords = birth_before.shape[0]
 
@@ -191,15 +342,74 @@ class PersistenceDiagram:
 
 		return np.sum(birth_side * death_side, axis=2)
 	
-	def generate_betti_numbers_grids(self, resolution=100, data_ranges_dim=None, save_plots=False):
-		
+	def get_betti_number_index(self, dimension):
+		"""
+		BettiNumberIndex over the pairs of a dimension, built when it is first needed.
+		"""
+		# Check __dict__ directly, a lazy loaded diagram would otherwise go through __getattr__
+		if 'betti_number_indices' not in self.__dict__:
+			self.betti_number_indices = {}
+		if dimension not in self.betti_number_indices:
+			self.betti_number_indices[dimension] = BettiNumberIndex(self.dimension_pairs[dimension])
+		return self.betti_number_indices[dimension]
+
+	def query_persistent_betti_numbers(self, birth_before, death_after, dimension):
+		"""
+		Count the number of scatter points that have birth < birth_before and death > death_after at arbitrary points,
+		instead of on every combination of thresholds like get_persistent_betti_numbers. See BettiNumberIndex.
+		:param birth_before: Birth thresholds, an array of any shape
+		:param death_after: Death thresholds, broadcast against birth_before
+		"""
+		return self.get_betti_number_index(dimension).query(birth_before, death_after)
+
+	def get_minkowski_functionals(self, thresholds):
+		"""
+		Minkowski functionals of the excursion sets of the maps, averaged over the maps. See Map.get_minkowski_functionals.
+		The maps are needed, so they must not be deleted (do_delete_maps).
+		:param thresholds: Ascending thresholds of the excursion sets
+		:return: Array of shape (3, len(thresholds))
+		"""
+		return np.average([map.get_minkowski_functionals(thresholds) for map in self.maps], axis=0)
+
+	def _load_betti_numbers_grids(self, triangle=False):
+		# Returns whether the BettiNumbersGrids could be loaded from products
 		self.betti_numbers_grids = {}
 
 		if not self.recalculate:
-			if os.path.exists(os.path.join(self.product_loc, 'betti_number_grids')):
-				self.betti_numbers_grids[0] = load_betti_numbers_grid(os.path.join(self.product_loc, 'betti_number_grids'), 0)
-				self.betti_numbers_grids[1] = load_betti_numbers_grid(os.path.join(self.product_loc, 'betti_number_grids'), 1)
-				return self.betti_numbers_grids
+			# Grids are saved in betti_numbers_grid, older products were read from betti_number_grids
+			for grids_dir in ['betti_numbers_grid', 'betti_number_grids']:
+				try:
+					self.betti_numbers_grids = {dim: load_betti_numbers_grid(os.path.join(self.product_loc, grids_dir), dim, triangle) for dim in [0, 1]}
+					return True
+				except FileNotFoundError:
+					continue
+		return False
+
+	def _load_resolutions_betti_numbers_grids(self, resolutions, data_ranges_dim, triangle, counts):
+		"""
+		Loads the BettiNumbersGrids saved by generate_betti_numbers_grids_multi_resolution.
+		:return: Dictionary with the BettiNumbersGrid of each dimension for every resolution, None when the grids of one of the resolutions
+			were not saved or were saved on another grid, as triangle or with(out) counts
+		"""
+		if self.recalculate:
+			return None
+
+		resolutions_grids = {}
+		for resolution in resolutions:
+			try:
+				grids = {dim: load_betti_numbers_grid(os.path.join(self.product_loc, f'betti_numbers_grid_{resolution}'), dim, triangle) for dim in [0, 1]}
+			except FileNotFoundError:
+				return None
+			if not _betti_numbers_grids_match(grids, resolution, triangle, counts, data_ranges_dim):
+				return None
+			resolutions_grids[resolution] = grids
+		return resolutions_grids
+
+	def generate_betti_numbers_grids(self, resolution=100, data_ranges_dim=None, save_plots=False):
+		
+		if self._load_betti_numbers_grids() and all(self.betti_numbers_grids[dim].get_stored_map().shape == (resolution, resolution) for dim in [0, 1]):
+			return self.betti_numbers_grids
+		self.betti_numbers_grids = {}
 
 		for dimension in self.dimension_pairs:
 			if dimension == 'all':
@@ -243,15 +453,14 @@ class PersistenceDiagram:
 		return self.betti_numbers_grids
 
 
-	def generate_heatmaps(self, resolution=1000, gaussian_kernel_size_in_sigma=3):
+	def generate_heatmaps(self, resolution=1000, gaussian_kernel_size_in_sigma=3, engine='direct', save_plots=True):
 		"""
 		Generates the heatmaps corresponding to the birth and death times given calculated by get_persistence.
 		The heatmap is a convolution of the birth and death times (scatterplot) with a 2D Gaussian.
 		:param resolution: The number of pixels in one axis, the resulting heatmap is always a square of size resolution x resolution
+		:param engine: How the convolution is calculated, 'direct', 'separable' or 'fft', see gaussian_smooth
+		:param save_plots: Whether to save a figure of every heatmap
 		"""
-		from scipy.signal import convolve2d
-		from scipy.signal.windows import gaussian
-
 		self.heatmaps = {}
 
 		if not self.recalculate and os.path.exists(os.path.join(self.product_loc, 'heatmaps')):
@@ -259,48 +468,320 @@ class PersistenceDiagram:
 			self.heatmaps[1] = load_heatmap(os.path.join(self.product_loc, 'heatmaps'), 1)
 			return self.heatmaps
 
+		for dimension in self.dimension_pairs:
+			if dimension == 'all':
+				continue
+
+			hist, data_range = self._heatmap_histogram(dimension, resolution)
+			heatmap = gaussian_smooth(hist, _heatmap_kernel1d(data_range, resolution, gaussian_kernel_size_in_sigma), engine=engine)
+		
+			self.heatmaps[dimension] = Heatmap(heatmap, data_range, data_range, dimension)
+
+			self.heatmaps[dimension].save(os.path.join(self.product_loc, 'heatmaps'))
+
+			if save_plots:
+				self.heatmaps[dimension].save_figure(os.path.join(self.plot_loc, 'heatmaps'))#, scatter_points=(x, y))
+		
+		return self.heatmaps
+
+	def _heatmap_histogram(self, dimension, resolution):
 		# convolve2d takes two arrays as input
 		# We need to generate a 2D array with 1s in the spot of each (birth, death) scatter point
 		# which will be convolved with a 2D Gaussian
 
 		# The 2D map of the scatter points still has the same min and max in x and y
-		for dimension in self.dimension_pairs:
-			if dimension == 'all':
-				continue
+		x = self.dimension_pairs[dimension][:, 0]
+		y = self.dimension_pairs[dimension][:, 1]
 
-			x = self.dimension_pairs[dimension][:, 0]
-			y = self.dimension_pairs[dimension][:, 1]
+		# We want each pixel to be a square, so we need to find the largest range of values to cover
+		data_range = [
+			np.min(self.dimension_pairs[dimension][np.isfinite(self.dimension_pairs[dimension])]), 
+			np.max(self.dimension_pairs[dimension][np.isfinite(self.dimension_pairs[dimension])])
+		]
 
-			# We want each pixel to be a square, so we need to find the largest range of values to cover
-			data_range = [
-				np.min(self.dimension_pairs[dimension][np.isfinite(self.dimension_pairs[dimension])]), 
-				np.max(self.dimension_pairs[dimension][np.isfinite(self.dimension_pairs[dimension])])
-			]
+		# range = [x_range, y_range], set to equal so we have square pixels
+		hist, bin_edges_x, bin_edges_y = np.histogram2d(x, y, bins=resolution, range=[data_range, data_range])
+		return hist, data_range
 
-			# range = [x_range, y_range], set to equal so we have square pixels
-			hist, bin_edges_x, bin_edges_y = np.histogram2d(x, y, bins=resolution, range=[data_range, data_range])
 
-			# Scale parameter of the Gaussian
-			pixel_scale = np.abs(data_range[1] - data_range[0]) / resolution
-			# Determine the scale parameter (std, sigma) of the Gaussian kernel
-			# Set to 1/25th of the range, similar value as Heydenreich+2022
-			scale_parameter = 1. / 25. * np.abs(data_range[1] - data_range[0])
+def generate_betti_numbers_grids_batched(pds: List[PersistenceDiagram], resolution=100, data_ranges_dim=None, save=True, triangle=False, counts=False, thresholds_dim=None):
+	"""
+	Generates the BettiNumbersGrids of many PersistenceDiagrams in one vectorized pass instead of one pass per diagram.
+	All diagrams share the same grid, so data_ranges_dim must be given. Sets betti_numbers_grids of every PersistenceDiagram.
+	:param save: Whether to load and save the BettiNumbersGrids as .npy products of each PersistenceDiagram,
+		without saving they are always calculated
+	:param triangle: Whether to only calculate and store the grid points with birth <= death, see TriangleBettiNumbersGrid
+	:param counts: Whether to keep the counts in the smallest sufficient unsigned integer dtype instead of normalized grids,
+		the BettiNumbersGrids then normalize them when they are accessed, see betti_numbers_grids_normalizations
+	:param thresholds_dim: Birth (= death) thresholds of each dimension, e.g. from quantile_thresholds, instead of evenly spaced thresholds
+		over data_ranges_dim. The resolution is then the number of thresholds, which must be the same for both dimensions
+	:return: Array of shape (len(pds), 2, resolution, resolution) with the (normalized) BettiNumbersGrids,
+		or (len(pds), 2, resolution * (resolution + 1) / 2) with the grid points in the triangle
+	"""
+	if data_ranges_dim is None and thresholds_dim is None:
+		raise ValueError('data_ranges_dim or thresholds_dim must be given, batched BettiNumbersGrids share the same grid')
+	if thresholds_dim is not None:
+		resolution = thresholds_resolution(thresholds_dim)
+		data_ranges_dim = _thresholds_ranges(thresholds_dim)
+
+	grid_shape = (resolution * (resolution + 1) // 2,) if triangle else (resolution, resolution)
+	# Counts are put in a smaller dtype once the largest count is known
+	bngs = np.empty((len(pds), 2) + grid_shape, dtype=np.int64 if counts else float)
+	normalizations = np.empty((len(pds), 2), dtype=np.int64)
+
+	# Grids that are saved as products do not need to be recalculated
+	calculate_indices = []
+	for i, perdi in enumerate(pds):
+		if not save:
+			perdi.betti_numbers_grids = {}
+			calculate_indices.append(i)
+		elif perdi._load_betti_numbers_grids(triangle) and _betti_numbers_grids_match(
+				perdi.betti_numbers_grids, resolution, triangle, counts, data_ranges_dim, thresholds_dim
+			):
+			bngs[i] = [perdi.betti_numbers_grids[dim].get_stored_map() for dim in [0, 1]]
+			if counts:
+				normalizations[i] = [perdi.betti_numbers_grids[dim].normalization for dim in [0, 1]]
+		else:
+			perdi.betti_numbers_grids = {}
+			calculate_indices.append(i)
 
-			sigma_in_pixel = scale_parameter / pixel_scale
-			gaussian_size_in_pixel = sigma_in_pixel * 2 * gaussian_kernel_size_in_sigma  # Two times because symmetric Gaussian with both sides
+	if len(calculate_indices) > 0:
+		# Read dimension_pairs once, lazy loaded diagrams would otherwise be read from disk for every dimension
+		pds_dimension_pairs = [pds[i].dimension_pairs for i in calculate_indices]
 
-			gaussian_kernel1d = gaussian(np.round(gaussian_size_in_pixel), std=sigma_in_pixel)
-			gaussian_kernel = np.outer(gaussian_kernel1d, gaussian_kernel1d)
+		for dim in [0, 1]:
+			ragged = RaggedDiagram.from_arrays([dimension_pairs[dim] for dimension_pairs in pds_dimension_pairs])
+			linspace = np.linspace(*data_ranges_dim[dim], resolution) if thresholds_dim is None else np.asarray(thresholds_dim[dim])
 
-			heatmap = convolve2d(hist, gaussian_kernel, mode='same')
-		
-			self.heatmaps[dimension] = Heatmap(heatmap, data_range, data_range, dimension)
+			if triangle:
+				grids = batched_persistent_betti_numbers(
+					ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, linspace, linspace, indices=triangle_indices(linspace, linspace)
+				)
+				# Normalized with the maximum of the full grid, which is at the largest birth and smallest death threshold
+				grids_max = batched_persistent_betti_numbers(
+					ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, linspace, linspace, indices=([np.argmin(linspace)], [np.argmax(linspace)])
+				)
+			else:
+				grids = batched_persistent_betti_numbers(ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, linspace, linspace)
+				# Normalize each grid separately
+				grids_max = np.max(grids, axis=(1, 2), keepdims=True)
 
-			self.heatmaps[dimension].save(os.path.join(self.product_loc, 'heatmaps'))
+			if counts:
+				bngs[calculate_indices, dim] = grids
+				normalizations[calculate_indices, dim] = grids_max.reshape(-1)
+			else:
+				bngs[calculate_indices, dim] = grids / grids_max
+
+		if counts:
+			bngs = bngs.astype(count_dtype(np.max(bngs, initial=0)))
+
+		for i in calculate_indices:
+			for dim in [0, 1]:
+				# The BettiNumbersGrid is a view into bngs, it is not copied
+				pds[i].betti_numbers_grids[dim] = _create_betti_numbers_grid(
+					bngs[i, dim], list(data_ranges_dim[dim]), dim, resolution, triangle, normalizations[i, dim] if counts else None,
+					None if thresholds_dim is None else thresholds_dim[dim]
+				)
+				if save:
+					pds[i].betti_numbers_grids[dim].save(os.path.join(pds[i].product_loc, 'betti_numbers_grid'))
+
+		del pds_dimension_pairs
+		for i in calculate_indices:
+			# Diagrams that still have to be written to a ProductStore keep their pairs
+			if pds[i].lazy_load and (pds[i].product_store is None or pds[i].product_store_location is not None):
+				pds[i].release_pairs()
+
+	if counts:
+		# Loaded grids were copied into bngs, which may have been replaced by an array of a smaller dtype
+		set_betti_numbers_grids(pds, bngs, data_ranges_dim, resolution, normalizations, thresholds_dim)
+
+	return bngs
+
+
+def _thresholds_ranges(thresholds_dim):
+	return {dim: [thresholds_dim[dim][0], thresholds_dim[dim][-1]] for dim in [0, 1]}
+
+
+def generate_betti_numbers_grids_multi_resolution(pds: List[PersistenceDiagram], resolutions, data_ranges_dim, save=True, triangle=False, counts=False):
+	"""
+	Generates the BettiNumbersGrids of many PersistenceDiagrams at several resolutions in one pass, see multi_resolution_persistent_betti_numbers.
+	Sets betti_numbers_grids of every PersistenceDiagram to the grids of the first resolution, use set_betti_numbers_grids for the others.
+	The grids of all resolutions have the same normalization, the count at the largest birth and smallest death threshold.
+	:param resolutions: Resolutions of the BettiNumbersGrids, e.g. [25, 50, 100, 200]
+	:param save: Whether to load and save the BettiNumbersGrids of every resolution as .npy products of each PersistenceDiagram,
+		next to each other in betti_numbers_grid_{resolution}. Without saving they are always calculated
+	:param triangle: See generate_betti_numbers_grids_batched
+	:param counts: See generate_betti_numbers_grids_batched
+	:return: Dictionary with for every resolution an array as returned by generate_betti_numbers_grids_batched
+	"""
+	resolutions_bngs = {
+		resolution: np.empty((len(pds), 2) + _grid_shape(resolution, triangle), dtype=np.int64 if counts else float)
+		for resolution in resolutions
+	}
+	normalizations = np.empty((len(pds), 2), dtype=np.int64)
+
+	# Diagrams with saved grids of every resolution on the same grid do not need to be recalculated
+	calculate_indices = []
+	for i, perdi in enumerate(pds):
+		resolutions_grids = perdi._load_resolutions_betti_numbers_grids(resolutions, data_ranges_dim, triangle, counts) if save else None
+		if resolutions_grids is None:
+			calculate_indices.append(i)
+			continue
+		for resolution in resolutions:
+			resolutions_bngs[resolution][i] = [resolutions_grids[resolution][dim].get_stored_map() for dim in [0, 1]]
+		if counts:
+			normalizations[i] = [resolutions_grids[resolutions[0]][dim].normalization for dim in [0, 1]]
+
+	if len(calculate_indices) > 0:
+		# Read dimension_pairs once, lazy loaded diagrams would otherwise be read from disk for every dimension
+		pds_dimension_pairs = [pds[i].dimension_pairs for i in calculate_indices]
+
+		for dim in [0, 1]:
+			ragged = RaggedDiagram.from_arrays([dimension_pairs[dim] for dimension_pairs in pds_dimension_pairs])
+			linspaces = [np.linspace(*data_ranges_dim[dim], resolution) for resolution in resolutions]
+
+			grids = multi_resolution_persistent_betti_numbers(ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, linspaces, triangle=triangle)
+			# Every grid starts and ends at the same thresholds, so they have the same maximum
+			normalizations[calculate_indices, dim] = batched_persistent_betti_numbers(
+				ragged.pairs[:, 0], ragged.pairs[:, 1], ragged.offsets, linspaces[0][-1:], linspaces[0][:1]
+			)[:, 0, 0]
+
+			for resolution, resolution_grids in zip(resolutions, grids):
+				if counts:
+					resolutions_bngs[resolution][calculate_indices, dim] = resolution_grids
+				else:
+					resolutions_bngs[resolution][calculate_indices, dim] = normalize_betti_numbers_grids(resolution_grids, normalizations[calculate_indices, dim])
+
+		del pds_dimension_pairs
+
+	if counts:
+		resolutions_bngs = {resolution: bngs.astype(count_dtype(np.max(normalizations, initial=0))) for resolution, bngs in resolutions_bngs.items()}
+
+	for resolution in reversed(resolutions):
+		set_betti_numbers_grids(pds, resolutions_bngs[resolution], data_ranges_dim, resolution, normalizations if counts else None)
+		if save:
+			for i in calculate_indices:
+				for dim in [0, 1]:
+					pds[i].betti_numbers_grids[dim].save(os.path.join(pds[i].product_loc, f'betti_numbers_grid_{resolution}'))
+
+	for i in calculate_indices:
+		# Diagrams that still have to be written to a ProductStore keep their pairs
+		if pds[i].lazy_load and (pds[i].product_store is None or pds[i].product_store_location is not None):
+			pds[i].release_pairs()
+
+	return resolutions_bngs
+
+
+def _grid_shape(resolution, triangle):
+	return (resolution * (resolution + 1) // 2,) if triangle else (resolution, resolution)
+
+
+def _betti_numbers_grids_match(grids, resolution, triangle, counts, data_ranges_dim, thresholds_dim=None):
+	# Whether loaded BettiNumbersGrids were saved on the same grid, as triangle or not and with(out) counts
+	for dim in [0, 1]:
+		if grids[dim].get_stored_map().shape != _grid_shape(resolution, triangle) or (grids[dim].normalization is not None) != counts:
+			return False
+		if not np.allclose(grids[dim].x_range, data_ranges_dim[dim]):
+			return False
+		x_values = getattr(grids[dim], 'x_values', None)
+		if (x_values is None) != (thresholds_dim is None) or (x_values is not None and not np.allclose(x_values, thresholds_dim[dim])):
+			return False
+	return True
+
+
+def generate_heatmaps_batched(pds: List[PersistenceDiagram], resolution=1000, gaussian_kernel_size_in_sigma=3, engine='fft', save=True, save_plots=False):
+	"""
+	Generates the heatmaps of many PersistenceDiagrams, see PersistenceDiagram.generate_heatmaps, smoothing the histograms
+	of all diagrams in one call. Sets heatmaps of every PersistenceDiagram.
+	:param engine: How the convolution is calculated, 'direct', 'separable' or 'fft', see gaussian_smooth
+	:param save: Whether to save the heatmaps as .npy products of each PersistenceDiagram
+	:param save_plots: Whether to save a figure of every heatmap
+	:return: Array of shape (len(pds), 2, resolution, resolution) with the heatmaps
+	"""
+	heatmaps = np.empty((len(pds), 2, resolution, resolution))
+	for perdi in pds:
+		perdi.heatmaps = {}
+
+	for dim in [0, 1]:
+		histograms, data_ranges = zip(*[perdi._heatmap_histogram(dim, resolution) for perdi in pds])
+		# The Gaussian is 1/25th of the range of every diagram, which is always the same number of pixels
+		heatmaps[:, dim] = gaussian_smooth(np.array(histograms), _heatmap_kernel1d(data_ranges[0], resolution, gaussian_kernel_size_in_sigma), engine=engine)
+
+		for i, perdi in enumerate(pds):
+			perdi.heatmaps[dim] = Heatmap(heatmaps[i, dim], data_ranges[i], data_ranges[i], dim)
+			if save:
+				perdi.heatmaps[dim].save(os.path.join(perdi.product_loc, 'heatmaps'))
+			if save_plots:
+				perdi.heatmaps[dim].save_figure(os.path.join(perdi.plot_loc, 'heatmaps'))
+
+	return heatmaps
+
+
+def _heatmap_kernel1d(data_range, resolution, gaussian_kernel_size_in_sigma):
+	from scipy.signal.windows import gaussian
+
+	# Scale parameter of the Gaussian
+	pixel_scale = np.abs(data_range[1] - data_range[0]) / resolution
+	# Determine the scale parameter (std, sigma) of the Gaussian kernel
+	# Set to 1/25th of the range, similar value as Heydenreich+2022
+	scale_parameter = 1. / 25. * np.abs(data_range[1] - data_range[0])
+
+	sigma_in_pixel = scale_parameter / pixel_scale
+	gaussian_size_in_pixel = sigma_in_pixel * 2 * gaussian_kernel_size_in_sigma  # Two times because symmetric Gaussian with both sides
+
+	return gaussian(np.round(gaussian_size_in_pixel), std=sigma_in_pixel)
+
+
+def count_dtype(max_count):
+	"""
+	:return: Smallest unsigned integer dtype, at least uint16, that holds counts up to max_count
+	"""
+	for dtype in [np.uint16, np.uint32]:
+		if max_count <= np.iinfo(dtype).max:
+			return dtype
+	return np.uint64
+
+
+def betti_numbers_grids_normalizations(pds: List[PersistenceDiagram]):
+	"""
+	:return: Array of shape (len(pds), 2) with the normalization of the BettiNumbersGrids of every PersistenceDiagram,
+		for BettiNumbersGrids generated with counts
+	"""
+	return np.array([[perdi.betti_numbers_grids[dim].normalization for dim in [0, 1]] for perdi in pds])
+
+
+def normalize_betti_numbers_grids(bngs, normalizations):
+	"""
+	Normalizes counts as returned by generate_betti_numbers_grids_batched with counts.
+	:param normalizations: Array as returned by betti_numbers_grids_normalizations, with the same leading dimensions as bngs
+	"""
+	return bngs / normalizations.reshape(normalizations.shape + (1,) * (bngs.ndim - normalizations.ndim))
+
+
+def set_betti_numbers_grids(pds: List[PersistenceDiagram], bngs, data_ranges_dim, resolution=100, normalizations=None, thresholds_dim=None):
+	"""
+	Sets the betti_numbers_grids of every PersistenceDiagram to views into bngs, e.g. after reading them from a ProductStore.
+	:param bngs: Array as returned by generate_betti_numbers_grids_batched, with full grids or triangles
+	:param normalizations: Normalizations of the grids when bngs holds counts, see betti_numbers_grids_normalizations
+	:param thresholds_dim: Thresholds of the grids when they are not evenly spaced, see generate_betti_numbers_grids_batched
+	"""
+	triangle = bngs.ndim == 3
+	if thresholds_dim is not None:
+		resolution = thresholds_resolution(thresholds_dim)
+		data_ranges_dim = _thresholds_ranges(thresholds_dim)
+	for i, perdi in enumerate(pds):
+		perdi.betti_numbers_grids = {
+			dim: _create_betti_numbers_grid(
+				bngs[i, dim], list(data_ranges_dim[dim]), dim, resolution, triangle, None if normalizations is None else normalizations[i, dim],
+				None if thresholds_dim is None else thresholds_dim[dim]
+			) for dim in [0, 1]
+		}
 
-			self.heatmaps[dimension].save_figure(os.path.join(self.plot_loc, 'heatmaps'))#, scatter_points=(x, y))
-		
-		return self.heatmaps
+
+def _create_betti_numbers_grid(values, data_range, dimension, resolution, triangle, normalization=None, thresholds=None):
+	if triangle:
+		return TriangleBettiNumbersGrid(values, data_range, data_range, dimension, resolution, normalization=normalization, thresholds=thresholds)
+	return BettiNumbersGrid(values, data_range, data_range, dimension=dimension, normalization=normalization, thresholds=thresholds)
 
 
 def load_heatmap(path, dimension):
@@ -322,8 +803,8 @@ def load_heatmap(path, dimension):
 	return _load_ranged_map(path, dimension, Heatmap)
 
 
-def load_betti_numbers_grid(path, dimension):
-	return _load_ranged_map(path, dimension, BettiNumbersGrid)
+def load_betti_numbers_grid(path, dimension, triangle=False):
+	return _load_ranged_map(path, dimension, TriangleBettiNumbersGrid if triangle else BettiNumbersGrid)
 
 
 def load_betti_numbers_variance_map(path, dimension):
@@ -337,34 +818,67 @@ def _load_ranged_map(path, dimension, map_type):
 
 	
 class BaseRangedMap:
+	"""
+	Map with the x axis spanning x_range and the y axis spanning y_range. The axis values are evenly spaced,
+	unless x_values and y_values are given, e.g. for a grid of quantile thresholds.
+	"""
 
-	def __init__(self, map, x_range, y_range, dimension, name):
+	def __init__(self, map, x_range, y_range, dimension, name, x_values=None, y_values=None):
 		self.name = name
 		self.map = map
 		self.x_range = x_range
 		self.y_range = y_range
 		self.dimension = dimension
+		self.x_values = x_values
+		self.y_values = y_values
 	
 	def save(self, path):
 		file_system.check_folder_exists(path)
-		np.save(os.path.join(path, f'{self.name}_{self.dimension}.npy'), self.map)
+		np.save(os.path.join(path, f'{self.name}_{self.dimension}.npy'), self.get_stored_map())
 		np.save(os.path.join(path, f'x_range_{self.dimension}.npy'), self.x_range)
 		np.save(os.path.join(path, f'y_range_{self.dimension}.npy'), self.y_range)
+		for axis in ['x', 'y']:
+			values_path = os.path.join(path, f'{axis}_values_{self.dimension}.npy')
+			if getattr(self, f'{axis}_values', None) is not None:
+				np.save(values_path, getattr(self, f'{axis}_values'))
+			elif os.path.exists(values_path):
+				os.remove(values_path)
 
 	def load(self, path):
-		self.map = np.load(os.path.join(path, f'{self.name}_{self.dimension}.npy'))
+		self.set_stored_map(np.load(os.path.join(path, f'{self.name}_{self.dimension}.npy')))
 		self.x_range = np.load(os.path.join(path, f'x_range_{self.dimension}.npy'))
 		self.y_range = np.load(os.path.join(path, f'y_range_{self.dimension}.npy'))
+		for axis in ['x', 'y']:
+			values_path = os.path.join(path, f'{axis}_values_{self.dimension}.npy')
+			setattr(self, f'{axis}_values', np.load(values_path) if os.path.exists(values_path) else None)
+
+	def get_stored_map(self):
+		# The array the map is saved as, subclasses can store it in another form than map
+		return self.map
+
+	def set_stored_map(self, stored_map):
+		self.map = stored_map
 
 	def get_axis_values(self, axis):
+		# Maps created before axis values existed do not have the attributes
 		if axis == 'x':
-			return np.linspace(*self.x_range, num=len(self.map[0]))
+			x_values = getattr(self, 'x_values', None)
+			return x_values if x_values is not None else np.linspace(*self.x_range, num=len(self.map[0]))
 		elif axis == 'y':
-			return np.linspace(*self.y_range, num=len(self.map))
+			y_values = getattr(self, 'y_values', None)
+			return y_values if y_values is not None else np.linspace(*self.y_range, num=len(self.map))
+
+	def has_uniform_axes(self):
+		return getattr(self, 'x_values', None) is None and getattr(self, 'y_values', None) is None
 		
 	def plot(self, scatter_points=None, title=None, scatters_are_index=False, heatmap_scatter_points=False, cbar_label='$\kappa$'):
 		fig, ax = plt.subplots()
-		imax = ax.imshow(self._transform_map(), aspect='equal', extent=(*self.x_range, *self.y_range))
+		if self.has_uniform_axes():
+			imax = ax.imshow(self._transform_map(), aspect='equal', extent=(*self.x_range, *self.y_range))
+		else:
+			# Pixels of non-uniform axes have different sizes, the transformed map has the first y value in its last row
+			imax = ax.pcolormesh(self.get_axis_values('x'), self.get_axis_values('y'), self._transform_map()[::-1], shading='nearest')
+			ax.set_aspect('equal')
 		cbar = fig.colorbar(imax)
 		cbar.set_label(cbar_label)
 
@@ -412,9 +926,53 @@ class Heatmap(BaseRangedMap):
 
 
 class BettiNumbersGrid(BaseRangedMap):
+	"""
+	With a normalization, the grid is stored as integer counts and map divides them by the normalization when it is accessed,
+	so the counts are kept and the grid can be normalized differently without calculating it again.
+	Assigning a grid to map stores it as it is, without normalization.
+	The birth and death thresholds are evenly spaced over the ranges, unless thresholds are given, see quantile_thresholds.
+	"""
 
-	def __init__(self, betti_numbers_grid, birth_range, death_range, dimension):
-		super().__init__(betti_numbers_grid, birth_range, death_range, dimension, name='betti_numbers_grid')
+	def __init__(self, betti_numbers_grid, birth_range, death_range, dimension, normalization=None, thresholds=None):
+		super().__init__(betti_numbers_grid, birth_range, death_range, dimension, name='betti_numbers_grid', x_values=thresholds, y_values=thresholds)
+		self.normalization = normalization
+
+	@property
+	def map(self):
+		if self.normalization is None or self._values is None:
+			return self._values
+		return self._values / self.normalization
+
+	@map.setter
+	def map(self, grid):
+		self._values = grid
+		self.normalization = None
+
+	@property
+	def counts(self):
+		"""
+		The grid of counts, None when the grid is not stored as counts.
+		"""
+		return None if self.normalization is None else self._values
+
+	def get_stored_map(self):
+		return self._values
+
+	def set_stored_map(self, stored_map):
+		self._values = stored_map
+
+	def save(self, path):
+		super().save(path)
+		normalization_path = os.path.join(path, f'normalization_{self.dimension}.npy')
+		if self.normalization is not None:
+			np.save(normalization_path, self.normalization)
+		elif os.path.exists(normalization_path):
+			os.remove(normalization_path)
+
+	def load(self, path):
+		super().load(path)
+		normalization_path = os.path.join(path, f'normalization_{self.dimension}.npy')
+		self.normalization = np.load(normalization_path)[()] if os.path.exists(normalization_path) else None
 
 	def _transform_map(self):
 		return self.map[::-1, :]
@@ -423,16 +981,80 @@ class BettiNumbersGrid(BaseRangedMap):
 		return super().plot(scatter_points, title, scatters_are_index, heatmap_scatter_points, cbar_label=f'Normalized $\\beta_{self.dimension}(t_b, t_d)$')
 	
 
+class TriangleBettiNumbersGrid(BettiNumbersGrid):
+	"""
+	BettiNumbersGrid that only stores the grid points where the birth threshold is not larger than the death threshold,
+	the part of the grid that is meaningful, in triangle_values. map gives a full grid when it is accessed,
+	with 0 at the other grid points, and assigning a full grid to map keeps only its triangle.
+	"""
+
+	def __init__(self, triangle_values, birth_range, death_range, dimension, resolution=None, normalization=None, thresholds=None):
+		self.resolution = resolution
+		self.triangle_values = triangle_values
+		BaseRangedMap.__init__(
+			self, None, birth_range, death_range, dimension, name='betti_numbers_grid_triangle', x_values=thresholds, y_values=thresholds
+		)
+		self.normalization = normalization
+
+	@property
+	def map(self):
+		if self.triangle_values is None:
+			return None
+		values = self.triangle_values if self.normalization is None else self.triangle_values / self.normalization
+		return triangle_to_grid(values, self.get_triangle_indices(), (self.resolution, self.resolution))
+
+	@map.setter
+	def map(self, grid):
+		if grid is not None:
+			self.resolution = len(grid)
+			self.triangle_values = np.asarray(grid)[self.get_triangle_indices()]
+			self.normalization = None
+
+	@property
+	def counts(self):
+		if self.normalization is None:
+			return None
+		return triangle_to_grid(self.triangle_values, self.get_triangle_indices(), (self.resolution, self.resolution))
+
+	def get_triangle_indices(self):
+		return triangle_indices(self.get_axis_values('x'), self.get_axis_values('y'))
+
+	def get_axis_values(self, axis):
+		# Does not build the full grid to find the resolution
+		if not self.has_uniform_axes():
+			return super().get_axis_values(axis)
+		if axis == 'x':
+			return np.linspace(*self.x_range, num=self.resolution)
+		elif axis == 'y':
+			return np.linspace(*self.y_range, num=self.resolution)
+
+	def get_stored_map(self):
+		return self.triangle_values
+
+	def set_stored_map(self, stored_map):
+		self.triangle_values = stored_map
+		# The triangle of a resolution x resolution grid has resolution * (resolution + 1) / 2 grid points
+		self.resolution = int(round((np.sqrt(8 * len(self.triangle_values) + 1) - 1) / 2))
+
+
 class BettiNumbersGridVarianceMap(BaseRangedMap):
 
-	def __init__(self, betti_numbers_grids: List[BettiNumbersGrid], birth_range=None, death_range=None, dimension=None):
+	def __init__(self, betti_numbers_grids: Union[List[BettiNumbersGrid], np.ndarray], birth_range=None, death_range=None, dimension=None):
+		# An array of shape (n_grids, resolution, resolution) can be passed directly, ranges and dimension must then be given
+		if isinstance(betti_numbers_grids, np.ndarray):
+			super().__init__(np.std(betti_numbers_grids, axis=0), birth_range, death_range, dimension, name='betti_numbers_grid_variance_map')
+			return
+
 		if birth_range is None:
 			birth_range = betti_numbers_grids[0].x_range
 		if death_range is None:
 			death_range = betti_numbers_grids[0].y_range
 		if dimension is None:
 			dimension = betti_numbers_grids[0].dimension
-		super().__init__(None, birth_range, death_range, dimension, name='betti_numbers_grid_variance_map')
+		super().__init__(
+			None, birth_range, death_range, dimension, name='betti_numbers_grid_variance_map',
+			x_values=getattr(betti_numbers_grids[0], 'x_values', None), y_values=getattr(betti_numbers_grids[0], 'y_values', None)
+		)
 
 		grids = []
 		for bng in betti_numbers_grids:
@@ -440,6 +1062,15 @@ class BettiNumbersGridVarianceMap(BaseRangedMap):
 		
 		self.map = np.std(grids, axis=0)
 
+	@classmethod
+	def from_std(cls, std, birth_range, death_range, dimension, thresholds=None):
+		# Variance map of which the standard deviation has already been calculated
+		variance_map = cls.__new__(cls)
+		BaseRangedMap.__init__(
+			variance_map, std, birth_range, death_range, dimension, name='betti_numbers_grid_variance_map', x_values=thresholds, y_values=thresholds
+		)
+		return variance_map
+
 	def _transform_map(self):
 		return self.map[::-1, :]
 	
@@ -460,7 +1091,10 @@ class PixelDistinguishingPowerMap(BaseRangedMap):
 			raise ValueError('Birth ranges are different for cosmoSLICS and SLICS BettiNumbersGrids')
 		if not np.all([np.allclose(slics_bng.x_range, slics_variance.x_range), np.allclose(slics_bng.y_range, slics_variance.y_range)]):
 			raise ValueError('Ranges of SLICS BettiNumbersGrid and BettiNumbersVarianceGrid are different')
-		super().__init__(None, slics_bng.x_range, slics_bng.y_range, dimension, 'pixel_distinguishing_power')
+		super().__init__(
+			None, slics_bng.x_range, slics_bng.y_range, dimension, 'pixel_distinguishing_power',
+			x_values=getattr(slics_bng, 'x_values', None), y_values=getattr(slics_bng, 'y_values', None)
+		)
 
 		self.map = np.mean(np.abs((np.array([cbng.map for cbng in cosmoslics_bngs]) - slics_bng.map) / slics_variance.map), axis=0)
 
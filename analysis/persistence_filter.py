@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class PersistenceFilter:
+	"""
+	Drops (birth, death) pairs from persistence diagrams, e.g. short lived noise features, before they are saved
+	and counted in BettiNumbersGrids. A pair is kept when it passes every check that is set:
+		min_lifetime: death - birth >= min_lifetime
+		birth_range: birth_range[0] <= birth <= birth_range[1]
+		death_range: death_range[0] <= death <= death_range[1], pairs with infinite death are only dropped by drop_infinite
+		drop_infinite: death is finite
+	"""
+
+	def __init__(self, min_lifetime=None, birth_range=None, death_range=None, drop_infinite=False):
+		self.min_lifetime = min_lifetime
+		self.birth_range = birth_range
+		self.death_range = death_range
+		self.drop_infinite = drop_infinite
+
+	def config(self):
+		"""
+		:return: JSON serializable dictionary with the settings, products made with other settings are stale
+		"""
+		return {
+			'min_lifetime': None if self.min_lifetime is None else float(self.min_lifetime),
+			'birth_range': None if self.birth_range is None else [float(value) for value in self.birth_range],
+			'death_range': None if self.death_range is None else [float(value) for value in self.death_range],
+			'drop_infinite': bool(self.drop_infinite)
+		}
+
+	def mask(self, pairs):
+		"""
+		:return: Boolean array that is True for the pairs that are kept
+		"""
+		births = pairs[:, 0]
+		deaths = pairs[:, 1]
+		keep = np.ones(len(pairs), dtype=bool)
+
+		if self.min_lifetime is not None:
+			keep &= deaths - births >= self.min_lifetime
+		if self.birth_range is not None:
+			keep &= (births >= self.birth_range[0]) & (births <= self.birth_range[1])
+		if self.death_range is not None:
+			keep &= ((deaths >= self.death_range[0]) & (deaths <= self.death_range[1])) | np.isinf(deaths)
+		if self.drop_infinite:
+			keep &= np.isfinite(deaths)
+
+		return keep
+
+	def apply(self, dimension_pairs):
+		"""
+		:param dimension_pairs: Dictionary with the pairs of each dimension, like Map.dimension_pairs
+		:return: Dictionary with the kept pairs and dictionary with the number of removed pairs, for each dimension
+		"""
+		filtered_pairs = {}
+		removed_count = {}
+		for dimension, pairs in dimension_pairs.items():
+			keep = self.mask(pairs)
+			filtered_pairs[dimension] = pairs[keep]
+			removed_count[dimension] = int(len(pairs) - np.count_nonzero(keep))
+		return filtered_pairs, removed_count
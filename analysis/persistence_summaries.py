@@ -0,0 +1,76 @@
+import numpy as np
+from scipy.special import ndtr
+
+
+def _finite_features(births: np.ndarray, deaths: np.ndarray, offsets):
+	"""
+	Features of the diagrams offsets[i] up to offsets[i + 1] that have a finite death.
+	:return: Births, deaths, the diagram index of every feature and the number of features of every diagram
+	"""
+	offsets = np.asarray(offsets)
+	births = births[offsets[0]:offsets[-1]]
+	deaths = deaths[offsets[0]:offsets[-1]]
+	diagram_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+	finite = np.isfinite(births) & np.isfinite(deaths)
+	diagram_index = diagram_index[finite]
+	return births[finite], deaths[finite], diagram_index, np.bincount(diagram_index, minlength=len(offsets) - 1)
+
+
+def persistence_images(births: np.ndarray, deaths: np.ndarray, offsets, birth_range, persistence_range, resolution=20, sigma=None):
+	"""
+	Persistence images of many diagrams at once, the features of diagram i are offsets[i] up to offsets[i + 1].
+	Every feature is a Gaussian at (birth, death - birth) weighted linearly by its persistence, pixels hold the integral of all Gaussians over the pixel.
+	The Gaussian is separable, so the integral is the product of one integral along each axis, which are calculated for all features at once.
+	Features with an infinite death are left out.
+	:param birth_range: Range of the birth axis of the images
+	:param persistence_range: Range of the persistence axis of the images, features with a persistence of persistence_range[1] have weight 1
+	:param resolution: Number of pixels along each axis
+	:param sigma: Standard deviation of the Gaussians, one pixel along the birth axis when None
+	:return: Array of shape (len(offsets) - 1, resolution, resolution) indexed by persistence (ascending) and birth
+	"""
+	births, deaths, diagram_index, counts = _finite_features(births, deaths, offsets)
+	persistence = deaths - births
+
+	birth_edges = np.linspace(*birth_range, resolution + 1)
+	persistence_edges = np.linspace(*persistence_range, resolution + 1)
+	if sigma is None:
+		sigma = birth_edges[1] - birth_edges[0]
+
+	# Integral of the Gaussian of every feature over every pixel along each axis, of shape (n_features, resolution)
+	birth_weights = np.diff(ndtr((birth_edges[np.newaxis, :] - births[:, np.newaxis]) / sigma), axis=1)
+	persistence_weights = np.diff(ndtr((persistence_edges[np.newaxis, :] - persistence[:, np.newaxis]) / sigma), axis=1)
+	persistence_weights *= np.clip(persistence / persistence_range[1], 0, 1)[:, np.newaxis]
+
+	images = np.zeros((len(counts), resolution, resolution))
+	ends = np.cumsum(counts)
+	for i, (count, end) in enumerate(zip(counts, ends)):
+		if count > 0:
+			images[i] = persistence_weights[end - count:end].T @ birth_weights[end - count:end]
+	return images
+
+
+def persistence_landscapes(births: np.ndarray, deaths: np.ndarray, offsets, thresholds: np.ndarray, n_landscapes=3):
+	"""
+	Persistence landscapes of many diagrams at once, the features of diagram i are offsets[i] up to offsets[i + 1].
+	Landscape k at threshold t is the (k + 1)th largest value of max(0, min(t - birth, death - t)) over the features of a diagram.
+	The tents of all features are sorted within their diagram at once, after which landscape k is row k of every diagram.
+	Features with an infinite death are left out.
+	:param thresholds: Thresholds at which the landscapes are evaluated
+	:param n_landscapes: Number of landscapes of every diagram
+	:return: Array of shape (len(offsets) - 1, n_landscapes, len(thresholds))
+	"""
+	births, deaths, diagram_index, counts = _finite_features(births, deaths, offsets)
+
+	tents = np.maximum(0, np.minimum(thresholds[np.newaxis, :] - births[:, np.newaxis], deaths[:, np.newaxis] - thresholds[np.newaxis, :]))
+	# Sort by diagram first and then by descending tent, for every threshold
+	order = np.lexsort((-tents, np.broadcast_to(diagram_index[:, np.newaxis], tents.shape)), axis=0)
+	tents = np.take_along_axis(tents, order, axis=0)
+
+	landscapes = np.zeros((len(counts), n_landscapes, len(thresholds)))
+	starts = np.cumsum(counts) - counts
+	for k in range(n_landscapes):
+		# Diagrams with k features or less have a landscape k of 0
+		has_landscape = counts > k
+		landscapes[has_landscape, k] = tents[starts[has_landscape] + k]
+	return landscapes
@@ -1,12 +1,21 @@
+import fnmatch
 import glob
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 
-from analysis.cosmology_data import CosmologyData
+from analysis.cosmology_data import CosmologyData, build_dataset, build_statistics_dataset
 from analysis.map import Map
-from analysis.persistence_diagram import BettiNumbersGrid, PersistenceDiagram
+from analysis.map_manifest import MapManifest
+from analysis.map_prefetcher import MapPrefetcher
+from analysis.betti_numbers import quantile_thresholds, subsample_thresholds, thresholds_resolution
+from analysis.persistence_cache import PersistenceCache
+from analysis.product_store import ProductStore
+from analysis.running_statistics import RunningStatistics
+from analysis.persistence_diagram import BettiNumbersGrid, PersistenceDiagram, generate_betti_numbers_grids_batched, set_betti_numbers_grids
+from analysis.persistence_diagram import betti_numbers_grids_normalizations, generate_betti_numbers_grids_multi_resolution, normalize_betti_numbers_grids
 from analysis.persistence_diagram import BettiNumbersGridVarianceMap, PixelDistinguishingPowerMap
 from utils.is_notebook import is_notebook
 
@@ -16,6 +25,40 @@ else:
 	from tqdm import tqdm
 
 
+def _process_los(map_paths, map_kwargs, perdi_kwargs, smoothing_scales=None):
+	# Module level function so it can be pickled and sent to worker processes
+	los_maps = [Map(map_path, **map_kwargs) for map_path in map_paths]
+	return _create_pds(los_maps, perdi_kwargs, smoothing_scales)
+
+
+def _create_pds(los_maps, perdi_kwargs, smoothing_scales=None):
+	"""
+	Creates the PersistenceDiagram of one LOS, combining regions.
+	:param smoothing_scales: Also create a PersistenceDiagram of the maps smoothed at every scale (see Map.smooth), with their own products
+	:return: The PersistenceDiagram, or with smoothing_scales a tuple with the PersistenceDiagram and a dictionary with the PersistenceDiagram of every scale
+	"""
+	perdi = PersistenceDiagram(los_maps, **perdi_kwargs)
+	if smoothing_scales is None:
+		return perdi
+
+	# Every map is smoothed at all scales at once when the persistence of one of the scales is calculated,
+	# maps of which the products of every scale are reused are not smoothed (nor read when lazily loaded)
+	scales_maps = [map.smooth(smoothing_scales, lazy_load=True) for map in los_maps]
+	scales_pds = {}
+	for i, scale in enumerate(smoothing_scales):
+		scale_kwargs = {
+			**perdi_kwargs,
+			'plots_dir': _smoothing_scale_dir(perdi_kwargs['plots_dir'], scale),
+			'products_dir': _smoothing_scale_dir(perdi_kwargs['products_dir'], scale)
+		}
+		scales_pds[scale] = PersistenceDiagram([maps[i] for maps in scales_maps], **scale_kwargs)
+	return perdi, scales_pds
+
+
+def _smoothing_scale_dir(directory, scale):
+	return os.path.join(directory, f'smoothing_scale_{scale:g}')
+
+
 class Pipeline:
 
 	def __init__(
@@ -31,8 +74,29 @@ class Pipeline:
 			do_remember_maps=True,
 			save_plots=False,
 			bng_resolution=100,
+			bng_resolutions=None,
+			bng_grid='linear',
+			bng_quantile_maps=100,
+			bng_triangle=False,
+			bng_counts=False,
 			three_sigma_mask=False,
-			lazy_load=False
+			lazy_load=False,
+			n_workers=1,
+			manifest_path=None,
+			rebuild_manifest=False,
+			mmap_maps=False,
+			map_dtype=None,
+			prefetch_depth=0,
+			prefetch_threads=4,
+			persistence_cache_dir=None,
+			product_backend='npy',
+			stream_averages=False,
+			stream_batch_size=32,
+			persistence_filter=None,
+			persistence_engine='gudhi',
+			persistence_tile_size=None,
+			persistence_tile_workers=1,
+			smoothing_scales=None
 		):
 		self.maps_dir = maps_dir
 		self.plots_dir = plots_dir
@@ -47,8 +111,77 @@ class Pipeline:
 		self.do_remember_maps = do_remember_maps
 		self.save_plots = save_plots
 		self.bng_resolution = bng_resolution
+		# Other resolutions of which the BettiNumbersGrids are calculated in the same pass as those of bng_resolution,
+		# their CosmologyDatas are put in resolutions_slics_data and resolutions_cosmoslics_datas
+		self.bng_resolutions = bng_resolutions
+		# 'linear' spaces the thresholds of the BettiNumbersGrids evenly over data_range, 'quantile' puts them at quantiles of the births
+		# and deaths of bng_quantile_maps randomly chosen maps, see find_quantile_thresholds
+		if bng_grid not in ['linear', 'quantile']:
+			raise ValueError(f'Unknown bng_grid {bng_grid}')
+		if bng_grid == 'quantile' and bng_resolutions is not None:
+			raise ValueError('bng_resolutions is only supported for the linear bng_grid')
+		self.bng_grid = bng_grid
+		self.bng_quantile_maps = bng_quantile_maps
+		self.bng_thresholds = None
+		# Only calculate and keep the grid points with birth <= death of every BettiNumbersGrid, see TriangleBettiNumbersGrid.
+		# Averages and standard deviations are still full grids, with 0 outside the triangle
+		self.bng_triangle = bng_triangle
+		# Keep the BettiNumbersGrids as integer counts, normalized when they are used, instead of as normalized float grids.
+		# This also gives the CosmologyDatas the average counts
+		self.bng_counts = bng_counts
 		self.three_sigma_mask = three_sigma_mask
 		self.lazy_load = lazy_load
+		# See Map, memory mapping and float32 maps reduce the memory of maps that are kept around
+		self.mmap_maps = mmap_maps
+		self.map_dtype = map_dtype
+		# Number of processes computing PersistenceDiagrams in read_maps, 1 runs everything in this process
+		self.n_workers = n_workers
+
+		# Number of LOS whose maps are read ahead on background threads when running with one worker, 0 disables prefetching.
+		# Prefetched maps are always read, so this only helps when the persistence is (re)calculated
+		self.prefetch_depth = prefetch_depth
+		self.prefetch_threads = prefetch_threads
+
+		# Directory of the PersistenceCache with the persistence pairs of every map, None disables the cache
+		self.persistence_cache = PersistenceCache(persistence_cache_dir) if persistence_cache_dir is not None else None
+
+		# 'npy' saves the products of every LOS as separate .npy files, 'hdf5' keeps all products in one ProductStore
+		if product_backend == 'hdf5':
+			self.product_store = ProductStore(os.path.join(products_dir, 'products.h5'))
+		elif product_backend == 'npy':
+			self.product_store = None
+		else:
+			raise ValueError(f'Unknown product_backend {product_backend}')
+
+		# Calculate the cosmoSLICS averages and standard deviations with RunningStatistics, without keeping the BettiNumbersGrid of every LOS.
+		# The CosmologyDatas of cosmoSLICS then have no per LOS BettiNumbersGrids
+		self.stream_averages = stream_averages
+		# Number of LOS whose BettiNumbersGrids are generated in one batch and added to the RunningStatistics at once
+		self.stream_batch_size = stream_batch_size
+		if stream_averages and self.product_store is not None:
+			raise ValueError('stream_averages cannot be combined with a ProductStore, which stores the BettiNumbersGrids of every LOS')
+		if stream_averages and bng_resolutions is not None:
+			raise ValueError('stream_averages cannot be combined with bng_resolutions, which keeps the BettiNumbersGrids of every LOS')
+
+		# PersistenceFilter applied to the pairs of every map, None keeps all pairs
+		self.persistence_filter = persistence_filter
+		# See Map, 'union_find' calculates the persistence of the maps without gudhi
+		self.persistence_engine = persistence_engine
+		# See Map, the 'union_find' engine can reduce large maps in tiles, with persistence_tile_workers processes per map
+		self.persistence_tile_size = persistence_tile_size
+		self.persistence_tile_workers = persistence_tile_workers
+
+		# Standard deviations in pixels of Gaussians the maps are also smoothed with after they are read, see Map.smooth.
+		# The CosmologyDatas of every scale are put in scales_slics_data and scales_cosmoslics_datas
+		self.smoothing_scales = smoothing_scales
+		if smoothing_scales is not None and self.product_store is not None:
+			raise ValueError('smoothing_scales cannot be combined with a ProductStore, the PersistenceDiagrams of every scale are saved as .npy files')
+		if smoothing_scales is not None and stream_averages:
+			raise ValueError('smoothing_scales cannot be combined with stream_averages')
+
+		# Index of all maps in maps_dir, built once and reused by later runs
+		self.manifest_path = manifest_path if manifest_path is not None else os.path.join(products_dir, 'map_manifest.json.gz')
+		self.rebuild_manifest = rebuild_manifest or force_recalculate
 
 		# List of cosmology names
 		self.cosmologies = [f'Cosmol{i}' for i in range(25)] + ['Cosmolfid', 'SLICS']
@@ -64,6 +197,8 @@ class Pipeline:
 
 	def run_pipeline(self):
 		self.find_max_min_values_maps()
+		if self.bng_grid == 'quantile':
+			self.find_quantile_thresholds()
 		self.read_maps()
 		self.calculate_variance()
 
@@ -181,8 +316,61 @@ class Pipeline:
 		
 		# ax.legend()
 
+	def find_quantile_thresholds(self):
+		"""
+		Sets bng_thresholds to quantile_thresholds of the births and deaths of bng_quantile_maps randomly chosen maps together,
+		with bng_resolution thresholds for each dimension, and data_range to the range of these thresholds.
+		Equal quantiles are only used once, the dimension with the most thresholds is then subsampled so both dimensions have as many.
+		All cosmologies share the thresholds, so the BettiNumbersGrids stay comparable.
+		"""
+		print('Determining quantile thresholds of BettiNumbersGrids...')
+		maps = self._get_manifest().query(zbin=self.filter_zbin, los=self.filter_los, region=self.filter_region)
+		# The same maps are chosen every run, so the thresholds do not change and products stay valid
+		rng = np.random.default_rng(0)
+		map_paths = np.sort(rng.choice(maps.path.values, size=min(self.bng_quantile_maps, len(maps)), replace=False))
+
+		dimension_values = {dim: [] for dim in [0, 1]}
+		for map_path in tqdm(map_paths, leave=False):
+			dimension_pairs = Map(map_path, **self._get_map_kwargs()).dimension_pairs
+			for dim in [0, 1]:
+				dimension_values[dim].append(dimension_pairs[dim].reshape(-1))
+
+		thresholds_dim = {dim: quantile_thresholds(np.concatenate(dimension_values[dim]), self.bng_resolution) for dim in [0, 1]}
+		# The BettiNumbersGrids of both dimensions are stored in one array, so they need the same number of thresholds
+		resolution = min(len(thresholds_dim[dim]) for dim in [0, 1])
+		self.bng_thresholds = {dim: subsample_thresholds(thresholds_dim[dim], resolution) for dim in [0, 1]}
+		self.data_range = {dim: [float(self.bng_thresholds[dim][0]), float(self.bng_thresholds[dim][-1])] for dim in [0, 1]}
+		return self.bng_thresholds
+
+	def _get_manifest(self):
+		# Index of all maps, loaded once
+		if getattr(self, 'manifest', None) is None:
+			self.manifest = MapManifest.load_or_build(self.maps_dir, self.manifest_path, rebuild=self.rebuild_manifest)
+		return self.manifest
+
+	def _get_map_kwargs(self):
+		return {
+			'three_sigma_mask': self.three_sigma_mask,
+			'lazy_load': self.lazy_load,
+			'mmap': self.mmap_maps,
+			'dtype': self.map_dtype,
+			# Entries are keyed on the map contents and never stale, so the cache is also used with force_recalculate
+			'persistence_cache': self.persistence_cache,
+			'persistence_filter': self.persistence_filter,
+			'persistence_engine': self.persistence_engine,
+			'persistence_tile_size': self.persistence_tile_size,
+			'persistence_tile_workers': self.persistence_tile_workers
+		}
+
+	def _get_bng_resolution(self):
+		# Quantile thresholds that are equal are only used once, so there can be fewer than bng_resolution
+		return self.bng_resolution if self.bng_thresholds is None else thresholds_resolution(self.bng_thresholds)
+
 	def read_maps(self):
 
+		if self.bng_grid == 'quantile' and self.bng_thresholds is None:
+			self.find_quantile_thresholds()
+
 		print(self.data_range)
 
 		# SLICS determines the sample variance, will be a list of persistence diagrams for each line of sight
@@ -196,56 +384,312 @@ class Pipeline:
   
 		self.cosmoslics_datas = []
 		self.slics_data = None
+		self.resolutions_cosmoslics_datas = {}
+		self.resolutions_slics_data = {}
+		self.scales_cosmoslics_datas = {}
+		self.scales_slics_data = {}
 
 		do_delete_maps = not self.do_remember_maps
 
-		print('Analyzing maps...')
-		# For each cosmology
-		cosm_tqdm = tqdm(self.cosmologies)
-		for cosmology in cosm_tqdm:
-			cosm_tqdm.set_description(f'{cosmology}')
-			curr_cosm_zbins = {}
-			# For each redshift bin
-			zbin_tqdm = tqdm(glob.glob(self._get_glob_str_dir(filter_cosmology=cosmology)), leave=False)
-			for dir in zbin_tqdm:
-				if os.path.isdir(dir):
-					zbin_tqdm.write(f'Processing maps in {dir}')
-
-					# Track all persistence diagrams
-					curr_zbin_pds = []
-
-					# For each LOS
-					los_list = self.slics_los if cosmology == 'SLICS' else self.cosmoslics_los
-					for los in los_list:
-						curr_los_maps = []
-						glob_str = self._get_glob_str_file(dir, filter_los=los)
-						# For each map
-						for i, map_path in enumerate(glob.glob(glob_str)):
-							los_map = Map(map_path, three_sigma_mask=self.three_sigma_mask, lazy_load=self.lazy_load)
-							zbin = los_map.zbin
-							curr_los_maps.append(los_map)
-							
-						# One PersistenceDiagram per LOS, combining regions
-						perdi = PersistenceDiagram(
-							curr_los_maps, do_delete_maps=do_delete_maps, lazy_load=self.lazy_load, recalculate=self.recalculate,
-							plots_dir=self.plots_dir, products_dir=self.products_dir
+		map_kwargs = self._get_map_kwargs()
+		perdi_kwargs = {
+			'do_delete_maps': do_delete_maps,
+			'lazy_load': self.lazy_load,
+			'recalculate': self.recalculate,
+			'plots_dir': self.plots_dir,
+			'products_dir': self.products_dir,
+			'product_store': self.product_store
+		}
+
+		filter_config = self.persistence_filter.config() if self.persistence_filter is not None else None
+
+		# Every LOS is independent, so they can be spread over a pool of processes
+		executor = ProcessPoolExecutor(max_workers=self.n_workers) if self.n_workers > 1 else None
+
+		# The workers are also shut down when a cosmology fails, queued LOS are then cancelled
+		try:
+			print('Reading map manifest...')
+			manifest = self._get_manifest()
+
+			print('Analyzing maps...')
+			# For each cosmology
+			cosm_tqdm = tqdm(self.cosmologies)
+			for cosmology in cosm_tqdm:
+				cosm_tqdm.set_description(f'{cosmology}')
+				# SLICS is always needed for the covariance, other cosmologies can be filtered out
+				if cosmology != 'SLICS' and not fnmatch.fnmatchcase(cosmology, self.filter_cosmology):
+					continue
+
+				cosm_maps = manifest.query(cosmology=cosmology, zbin=self.filter_zbin, los=self.filter_los, region=self.filter_region)
+				los_list = self.slics_los if cosmology == 'SLICS' else self.cosmoslics_los
+
+				# For each redshift bin, the map paths of each LOS
+				cosm_zbins_paths = {}
+				for zbin, zbin_maps in cosm_maps.groupby('zbin'):
+					zbin_paths = [list(zbin_maps.path[zbin_maps.los == los]) for los in los_list]
+					cosm_zbins_paths[zbin] = [map_paths for map_paths in zbin_paths if len(map_paths) > 0]
+
+				# Zbins with products in the ProductStore made from the same maps with the same options are not read from the maps
+				stored_zbins = {}
+				if self.product_store is not None and not self.recalculate:
+					for zbin, zbin_paths in cosm_zbins_paths.items():
+						products = self.product_store.read(cosmology, zbin, with_pairs=not self.lazy_load)
+						if (
+								products is not None
+								and products['map_names'] == [os.path.basename(path) for map_paths in zbin_paths for path in map_paths]
+								and products['persistence_filter'] == filter_config
+								and self._stored_map_keys_match(products['map_keys'], zbin_paths, map_kwargs)
+							):
+							stored_zbins[zbin] = products
+
+				calculate_zbins = [zbin for zbin in cosm_zbins_paths if zbin not in stored_zbins]
+				calculated_zbins_pds = self._process_zbins([cosm_zbins_paths[zbin] for zbin in calculate_zbins], executor, map_kwargs, perdi_kwargs)
+				if self.smoothing_scales is not None:
+					calculated_zbins_scales_pds = [[scales_pds for _, scales_pds in zbin_pds] for zbin_pds in calculated_zbins_pds]
+					calculated_zbins_pds = [[perdi for perdi, _ in zbin_pds] for zbin_pds in calculated_zbins_pds]
+
+				if self.persistence_filter is not None:
+					# Diagrams loaded from products were filtered before and have no count
+					removed_counts = [perdi.__dict__.get('removed_pairs_count') for zbin_pds in calculated_zbins_pds for perdi in zbin_pds]
+					removed_counts = [count for count in removed_counts if count is not None]
+					if len(removed_counts) > 0:
+						removed = np.sum(removed_counts, axis=0)
+						cosm_tqdm.write(f'{cosmology}: PersistenceFilter removed {removed[0]:.0f} dimension 0 and {removed[1]:.0f} dimension 1 pairs from {len(removed_counts)} LOS')
+
+				# cosmoSLICS only need the averages, SLICS always keeps the BettiNumbersGrids of every LOS for the covariance
+				stream_averages = self.stream_averages and cosmology != 'SLICS'
+
+				curr_cosm_zbins = {}
+				curr_cosm_bngs = {}
+				curr_cosm_resolutions_bngs = {}
+				curr_cosm_statistics = {}
+				for zbin, curr_zbin_pds in zip(calculate_zbins, calculated_zbins_pds):
+					curr_cosm_zbins[zbin] = curr_zbin_pds
+					if stream_averages:
+						curr_cosm_statistics[zbin] = self._stream_statistics(curr_zbin_pds)
+						continue
+
+					# BettiNumbersGrids of all LOS in one pass
+					curr_cosm_bngs[zbin], curr_cosm_resolutions_bngs[zbin] = self._generate_bngs(curr_zbin_pds, save=self.product_store is None)
+
+					if self.product_store is not None:
+						self.product_store.write(
+							cosmology, zbin, curr_zbin_pds, curr_cosm_bngs[zbin], self.data_range, self._bng_normalizations(curr_zbin_pds), self.bng_thresholds,
+							self._other_resolutions_bngs(curr_cosm_resolutions_bngs[zbin])
+						)
+						for los_index, perdi in enumerate(curr_zbin_pds):
+							perdi.set_product_store_location(cosmology, los_index)
+
+				for zbin, products in stored_zbins.items():
+					curr_zbin_pds = [
+						PersistenceDiagram.from_product_store(
+							self.product_store, cosmology, zbin, products, los_index,
+							lazy_load=self.lazy_load, plots_dir=self.plots_dir, products_dir=self.products_dir
+						) for los_index in range(len(products['los']))
+					]
+					curr_cosm_zbins[zbin] = curr_zbin_pds
+
+					# BettiNumbersGrids on another grid are calculated again from the stored pairs
+					resolution = self._get_bng_resolution()
+					grid_shape = (resolution * (resolution + 1) // 2,) if self.bng_triangle else (resolution, resolution)
+					stored_bngs_match = (
+						products['bngs'].shape[2:] == grid_shape
+						and all(np.allclose(products['bng_ranges'][dim], self.data_range[dim]) for dim in [0, 1])
+						and (products['bng_normalizations'] is not None) == self.bng_counts
+						and (products['bng_thresholds'] is None) == (self.bng_thresholds is None)
+						and (self.bng_thresholds is None or all(np.array_equal(products['bng_thresholds'][dim], self.bng_thresholds[dim]) for dim in [0, 1]))
+					)
+					# The BettiNumbersGrids at the other resolutions of bng_resolutions are stored next to those of bng_resolution
+					other_resolutions = [resolution for resolution in self.bng_resolutions or [] if resolution != self.bng_resolution]
+					if stored_bngs_match and all(resolution in products['resolutions_bngs'] for resolution in other_resolutions):
+						curr_cosm_bngs[zbin] = products['bngs']
+						set_betti_numbers_grids(
+							curr_zbin_pds, curr_cosm_bngs[zbin], self.data_range, resolution=self.bng_resolution, normalizations=products['bng_normalizations'],
+							thresholds_dim=self.bng_thresholds
+						)
+						if self.bng_resolutions is not None:
+							curr_cosm_resolutions_bngs[zbin] = {
+								self.bng_resolution: products['bngs'], **{resolution: products['resolutions_bngs'][resolution] for resolution in other_resolutions}
+							}
+					else:
+						curr_cosm_bngs[zbin], curr_cosm_resolutions_bngs[zbin] = self._generate_bngs(curr_zbin_pds, save=False)
+						self.product_store.write_bngs(
+							cosmology, zbin, curr_cosm_bngs[zbin], self.data_range, self._bng_normalizations(curr_zbin_pds), self.bng_thresholds,
+							self._other_resolutions_bngs(curr_cosm_resolutions_bngs[zbin])
 						)
-						perdi.generate_betti_numbers_grids(resolution=self.bng_resolution, data_ranges_dim=self.data_range, save_plots=False)
-						curr_zbin_pds.append(perdi)
-			
-				curr_cosm_zbins[zbin] = curr_zbin_pds
-			
-			if cosmology != 'SLICS':
-				self.cosmoslics_datas.append(CosmologyData(cosmology, curr_cosm_zbins))
-			else:
-				# Put it in a list to make our live easier when compressing
-				# By making both cosmoslics_datas and slics_data a list, we can handle them the same in Compressor._build_training_set
-				self.slics_data = [CosmologyData(cosmology, curr_cosm_zbins, n_cosmoslics_los=len(curr_zbin_pds))]
+
+				if self.bng_resolutions is not None:
+					self._add_resolutions_datas(cosmology, curr_cosm_zbins, curr_cosm_bngs, curr_cosm_resolutions_bngs)
+
+				if self.smoothing_scales is not None:
+					self._add_scales_datas(cosmology, dict(zip(calculate_zbins, calculated_zbins_scales_pds)))
+
+				if stream_averages:
+					dataset = build_statistics_dataset(
+						curr_cosm_statistics, [perdi.los for perdi in curr_zbin_pds], self.data_range, curr_zbin_pds[0].cosm_parameters,
+						resolution=self.bng_resolution, thresholds_dim=self.bng_thresholds
+					)
+					self.cosmoslics_datas.append(CosmologyData(cosmology, curr_cosm_zbins, dataset=dataset))
+				elif cosmology != 'SLICS':
+					self.cosmoslics_datas.append(CosmologyData(cosmology, curr_cosm_zbins, zbins_bngs_tensors=curr_cosm_bngs))
+				else:
+					# Put it in a list to make our live easier when compressing
+					# By making both cosmoslics_datas and slics_data a list, we can handle them the same in Compressor._build_training_set
+					self.slics_data = [CosmologyData(cosmology, curr_cosm_zbins, n_cosmoslics_los=len(curr_zbin_pds), zbins_bngs_tensors=curr_cosm_bngs)]
+		finally:
+			if executor is not None:
+				executor.shutdown(cancel_futures=True)
 
 		self.zbins = list(self.slics_data[0].zbins_pds.keys())
 
 		return self.slics_data, self.cosmoslics_datas
 
+	def _process_zbins(self, zbins_paths, executor, map_kwargs, perdi_kwargs):
+		"""
+		Creates one PersistenceDiagram for every LOS, zbins_paths holds the map paths of each LOS for each zbin.
+		:return: List with a list of PersistenceDiagrams for each zbin
+		"""
+		los_counts = [len(zbin_paths) for zbin_paths in zbins_paths]
+		los_paths = [map_paths for zbin_paths in zbins_paths for map_paths in zbin_paths]
+
+		if executor is not None:
+			# All zbins are submitted at once to keep the workers busy
+			futures = [executor.submit(_process_los, map_paths, map_kwargs, perdi_kwargs, self.smoothing_scales) for map_paths in los_paths]
+			pds = [future.result() for future in tqdm(futures, leave=False)]
+		elif self.prefetch_depth > 0:
+			# Maps of the next LOS are read while the persistence of the current LOS is calculated.
+			# Lazy maps are only read by LOS whose products are calculated again, so the other LOS are not read ahead
+			prefetch = [self._los_needs_maps(map_paths, map_kwargs, perdi_kwargs) for map_paths in los_paths] if self.lazy_load else None
+			prefetcher = MapPrefetcher(los_paths, map_kwargs, depth=self.prefetch_depth, n_threads=self.prefetch_threads, prefetch=prefetch)
+			pds = [_create_pds(los_maps, perdi_kwargs, self.smoothing_scales) for los_maps in tqdm(prefetcher, total=len(los_paths), leave=False)]
+			tqdm.write(prefetcher.summary())
+		else:
+			pds = [_process_los(map_paths, map_kwargs, perdi_kwargs, self.smoothing_scales) for map_paths in tqdm(los_paths, leave=False)]
+
+		# Split the flat list back into zbins
+		ends = np.cumsum(los_counts)
+		return [pds[end - count:end] for count, end in zip(los_counts, ends)]
+
+	def _stored_map_keys_match(self, stored_map_keys, zbin_paths, map_kwargs):
+		"""
+		Whether products were made from the same map files with the same map options. Like in PersistenceDiagram.handle_maps,
+		the persistence cache keys of the maps are compared when the maps have them. The maps are not read.
+		"""
+		map_keys = [Map(path, **{**map_kwargs, 'lazy_load': True}).get_persistence_key() for map_paths in zbin_paths for path in map_paths]
+		return None in map_keys or stored_map_keys == map_keys
+
+	def _los_needs_maps(self, map_paths, map_kwargs, perdi_kwargs):
+		# Whether the persistence of the maps of a LOS, or of the maps smoothed at one of the smoothing_scales, is calculated,
+		# see PersistenceDiagram.needs_maps
+		maps = [Map(map_path, **map_kwargs) for map_path in map_paths]
+		maps_products_dirs = [(maps, perdi_kwargs['products_dir'])]
+		for scale in self.smoothing_scales or []:
+			scale_maps = [map.smooth([scale], lazy_load=True)[0] for map in maps]
+			maps_products_dirs.append((scale_maps, _smoothing_scale_dir(perdi_kwargs['products_dir'], scale)))
+		return any(
+			PersistenceDiagram.needs_maps(maps, recalculate=perdi_kwargs['recalculate'], products_dir=products_dir, product_store=perdi_kwargs['product_store'])
+			for maps, products_dir in maps_products_dirs
+		)
+
+	def _generate_bngs(self, pds, save):
+		"""
+		Generates the BettiNumbersGrids of all PersistenceDiagrams, at every resolution in bng_resolutions in the same pass.
+		:return: Array with the BettiNumbersGrids at bng_resolution, see generate_betti_numbers_grids_batched,
+			and dictionary with such an array for every resolution in bng_resolutions
+		"""
+		if self.bng_resolutions is None:
+			bngs = generate_betti_numbers_grids_batched(
+				pds, resolution=self.bng_resolution, data_ranges_dim=self.data_range, save=save, triangle=self.bng_triangle, counts=self.bng_counts,
+				thresholds_dim=self.bng_thresholds
+			)
+			return bngs, {}
+
+		resolutions = [self.bng_resolution] + [resolution for resolution in self.bng_resolutions if resolution != self.bng_resolution]
+		resolutions_bngs = generate_betti_numbers_grids_multi_resolution(
+			pds, resolutions, self.data_range, save=save, triangle=self.bng_triangle, counts=self.bng_counts
+		)
+		return resolutions_bngs[self.bng_resolution], resolutions_bngs
+
+	def _other_resolutions_bngs(self, resolutions_bngs):
+		# BettiNumbersGrids of the resolutions in bng_resolutions other than bng_resolution, None without bng_resolutions
+		if self.bng_resolutions is None:
+			return None
+		return {resolution: bngs for resolution, bngs in resolutions_bngs.items() if resolution != self.bng_resolution}
+
+	def _add_resolutions_datas(self, cosmology, zbins_pds, zbins_bngs, zbins_resolutions_bngs):
+		"""
+		Adds a CosmologyData for every resolution in bng_resolutions to resolutions_slics_data or resolutions_cosmoslics_datas.
+		The BettiNumbersGrids of the PersistenceDiagrams are those of bng_resolution again afterwards.
+		"""
+		zbins_normalizations = {zbin: self._bng_normalizations(pds) for zbin, pds in zbins_pds.items()}
+
+		for resolution in self.bng_resolutions:
+			if resolution == self.bng_resolution:
+				continue
+
+			zbins_bngs_tensors = {zbin: zbins_resolutions_bngs[zbin][resolution] for zbin in zbins_pds}
+			for zbin, pds in zbins_pds.items():
+				set_betti_numbers_grids(pds, zbins_bngs_tensors[zbin], self.data_range, resolution, zbins_normalizations[zbin])
+			# Built from a dataset, so the PersistenceDiagrams keep their own BettiNumbersGrids
+			cdata = CosmologyData(cosmology, n_cosmoslics_los=len(list(zbins_pds.values())[0]), dataset=build_dataset(zbins_pds, zbins_bngs_tensors))
+
+			if cosmology == 'SLICS':
+				self.resolutions_slics_data[resolution] = [cdata]
+			else:
+				self.resolutions_cosmoslics_datas.setdefault(resolution, []).append(cdata)
+
+		for zbin, pds in zbins_pds.items():
+			set_betti_numbers_grids(pds, zbins_bngs[zbin], self.data_range, self.bng_resolution, zbins_normalizations[zbin])
+
+	def _add_scales_datas(self, cosmology, zbins_scales_pds):
+		"""
+		Adds a CosmologyData for every scale in smoothing_scales to scales_slics_data or scales_cosmoslics_datas.
+		Their BettiNumbersGrids have the same thresholds as those of the maps that are not smoothed.
+		:param zbins_scales_pds: Dictionary with for each zbin a list with the dictionary of PersistenceDiagrams per scale of every LOS
+		"""
+		for scale in self.smoothing_scales:
+			zbins_pds = {zbin: [scales_pds[scale] for scales_pds in zbin_scales_pds] for zbin, zbin_scales_pds in zbins_scales_pds.items()}
+			zbins_bngs = {zbin: self._generate_bngs(pds, save=True)[0] for zbin, pds in zbins_pds.items()}
+			cdata = CosmologyData(
+				cosmology, zbins_pds, n_cosmoslics_los=len(list(zbins_pds.values())[0]), zbins_bngs_tensors=zbins_bngs, smoothing_scale=scale
+			)
+
+			if cosmology == 'SLICS':
+				self.scales_slics_data[scale] = [cdata]
+			else:
+				self.scales_cosmoslics_datas.setdefault(scale, []).append(cdata)
+
+	def _bng_normalizations(self, pds):
+		return betti_numbers_grids_normalizations(pds) if self.bng_counts else None
+
+	def _stream_statistics(self, pds):
+		"""
+		Adds the BettiNumbersGrids and feature counts of the PersistenceDiagrams to RunningStatistics in batches of stream_batch_size,
+		the BettiNumbersGrids of every batch are generated in one pass and not kept.
+		:return: Dictionary with RunningStatistics of 'bngs' and 'dimension_pairs_count', and of 'bng_counts' with bng_counts,
+			see build_statistics_dataset
+		"""
+		statistics = {
+			'bngs': RunningStatistics(),
+			'dimension_pairs_count': RunningStatistics()
+		}
+		if self.bng_counts:
+			statistics['bng_counts'] = RunningStatistics()
+		for start in range(0, len(pds), self.stream_batch_size):
+			batch_pds = pds[start:start + self.stream_batch_size]
+			bngs = generate_betti_numbers_grids_batched(
+				batch_pds, resolution=self.bng_resolution, data_ranges_dim=self.data_range, triangle=self.bng_triangle, counts=self.bng_counts,
+				thresholds_dim=self.bng_thresholds
+			)
+			if self.bng_counts:
+				statistics['bng_counts'].update_batch(bngs)
+				bngs = normalize_betti_numbers_grids(bngs, betti_numbers_grids_normalizations(batch_pds))
+			statistics['bngs'].update_batch(bngs)
+			statistics['dimension_pairs_count'].update_batch([perdi.dimension_pairs_count for perdi in batch_pds])
+			for perdi in batch_pds:
+				del perdi.betti_numbers_grids
+		return statistics
+
 	def calculate_variance(self):
 		print('Calculating SLICS/cosmoSLICS variance maps...')
 
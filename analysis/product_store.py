@@ -0,0 +1,183 @@
+import json
+import os
+
+import h5py
+import numpy as np
+
+from analysis.ragged_diagram import RaggedDiagram
+from utils import file_system
+
+
+class ProductStore:
+	"""
+	All PersistenceDiagram products in one HDF5 file, instead of a directory with several .npy files for every LOS.
+	Every cosmology in a zbin is one group /<zbin>/<cosmology> holding:
+		attributes cosmology and cosmology_id: As in PersistenceDiagram
+		attribute persistence_filter: JSON of the PersistenceFilter settings the pairs were filtered with
+		los: LOS numbers, as strings like in the map file names
+		maps_count: Number of maps (regions) of each LOS
+		map_names: File names of the maps of all LOS, used to detect products made from other maps
+		map_keys: Only when all maps have one, the persistence cache keys of the maps of all LOS (see Map.get_persistence_key),
+			used to detect products made from changed map files or with other map options
+		pairs_{dim}: (birth, death) pairs of all regions of all LOS, in chunked and compressed datasets
+		region_offsets_{dim}: The pairs of region i are pairs_{dim}[region_offsets_{dim}[i]:region_offsets_{dim}[i + 1]]
+		bngs: (Normalized) BettiNumbersGrids of all LOS, shape (n_los, 2, resolution, resolution)
+		bng_normalizations: Only when bngs holds counts, the normalization of every BettiNumbersGrid, shape (n_los, 2)
+		bng_thresholds: Only for BettiNumbersGrids that are not evenly spaced, the thresholds of each dimension
+		bng_ranges: Birth (= death) range of the BettiNumbersGrids of each dimension
+		bngs_resolution_{resolution}: Only with Pipeline.bng_resolutions, the BettiNumbersGrids at the other resolutions,
+			with the same normalizations and ranges as bngs
+	The file is opened for every call, so a ProductStore can be sent to other processes.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def _group_name(self, cosmology, zbin):
+		return f'{zbin}/{cosmology}'
+
+	def has(self, cosmology, zbin):
+		if not os.path.exists(self.path):
+			return False
+		with h5py.File(self.path, 'r') as file:
+			return self._group_name(cosmology, zbin) in file
+
+	def write(self, cosmology, zbin, pds, bngs, bng_ranges, bng_normalizations=None, bng_thresholds=None, resolutions_bngs=None):
+		"""
+		Stores the pairs of all PersistenceDiagrams of a cosmology in a zbin and their BettiNumbersGrids,
+		replacing what was stored before.
+		:param pds: PersistenceDiagrams of every LOS, with region_pairs and map_keys
+		:param bngs: Array of shape (len(pds), 2, resolution, resolution), see generate_betti_numbers_grids_batched
+		:param bng_ranges: Range of the BettiNumbersGrids of each dimension
+		:param bng_normalizations: Normalizations when bngs holds counts, see betti_numbers_grids_normalizations
+		:param bng_thresholds: Thresholds of each dimension when the BettiNumbersGrids are not evenly spaced
+		:param resolutions_bngs: Dictionary with the BettiNumbersGrids at other resolutions, see generate_betti_numbers_grids_multi_resolution
+		"""
+		file_system.check_folder_exists(os.path.dirname(self.path) or '.')
+		with h5py.File(self.path, 'a') as file:
+			name = self._group_name(cosmology, zbin)
+			if name in file:
+				del file[name]
+			group = file.create_group(name)
+
+			group.attrs['cosmology'] = pds[0].cosmology
+			group.attrs['cosmology_id'] = pds[0].cosmology_id
+			group.attrs['persistence_filter'] = json.dumps(pds[0].persistence_filter_config)
+			group.create_dataset('los', data=np.array([perdi.los for perdi in pds], dtype=h5py.string_dtype()))
+			group.create_dataset('maps_count', data=np.array([perdi.maps_count for perdi in pds]))
+			group.create_dataset('map_names', data=np.array([map_name for perdi in pds for map_name in perdi.map_names], dtype=h5py.string_dtype()))
+			if all(perdi.map_keys is not None for perdi in pds):
+				group.create_dataset('map_keys', data=np.array([map_key for perdi in pds for map_key in perdi.map_keys], dtype=h5py.string_dtype()))
+
+			for dim in [0, 1]:
+				los_pairs = RaggedDiagram.from_arrays([perdi.region_pairs[dim].pairs for perdi in pds])
+				# Offsets of every region, shifted to where the pairs of its LOS start
+				region_offsets = np.concatenate([[0]] + [
+					perdi.region_pairs[dim].offsets[1:] + los_offset
+					for perdi, los_offset in zip(pds, los_pairs.offsets[:-1])
+				])
+
+				group.create_dataset(
+					f'pairs_{dim}', data=los_pairs.pairs, maxshape=(None, 2),
+					chunks=(min(max(len(los_pairs.pairs), 1), 1 << 16), 2), compression='gzip', shuffle=True
+				)
+				group.create_dataset(f'region_offsets_{dim}', data=region_offsets)
+
+			self._write_bngs(group, bngs, bng_ranges, bng_normalizations, bng_thresholds, resolutions_bngs)
+
+	def write_bngs(self, cosmology, zbin, bngs, bng_ranges, bng_normalizations=None, bng_thresholds=None, resolutions_bngs=None):
+		"""
+		Replaces only the BettiNumbersGrids of a cosmology in a zbin, e.g. after changing the grid.
+		"""
+		with h5py.File(self.path, 'a') as file:
+			group = file[self._group_name(cosmology, zbin)]
+			del group['bngs']
+			del group['bng_ranges']
+			for name in list(group):
+				if name in ['bng_normalizations', 'bng_thresholds'] or name.startswith('bngs_resolution_'):
+					del group[name]
+			self._write_bngs(group, bngs, bng_ranges, bng_normalizations, bng_thresholds, resolutions_bngs)
+
+	def _write_bngs(self, group, bngs, bng_ranges, bng_normalizations, bng_thresholds, resolutions_bngs):
+		# One chunk per BettiNumbersGrid, counts keep their integer dtype
+		group.create_dataset('bngs', data=bngs, chunks=(1, *bngs.shape[1:]), compression='gzip', shuffle=True)
+		group.create_dataset('bng_ranges', data=np.array([bng_ranges[dim] for dim in [0, 1]]))
+		if bng_normalizations is not None:
+			group.create_dataset('bng_normalizations', data=bng_normalizations)
+		if bng_thresholds is not None:
+			group.create_dataset('bng_thresholds', data=np.array([bng_thresholds[dim] for dim in [0, 1]]))
+		if resolutions_bngs is not None:
+			for resolution, resolution_bngs in resolutions_bngs.items():
+				group.create_dataset(
+					f'bngs_resolution_{resolution}', data=resolution_bngs, chunks=(1, *resolution_bngs.shape[1:]), compression='gzip', shuffle=True
+				)
+
+	def read_zbin(self, zbin, cosmologies=None, with_pairs=True):
+		"""
+		Reads everything stored for a zbin with one open of the file.
+		:param cosmologies: Cosmologies to read, None reads all cosmologies stored for the zbin
+		:param with_pairs: Whether to read the pairs, without them only the index and BettiNumbersGrids are read
+		:return: Dictionary with for every stored cosmology a dictionary with the datasets of its group,
+			the pairs of each dimension are a RaggedDiagram over all regions
+		"""
+		if not os.path.exists(self.path):
+			return {}
+
+		zbin_products = {}
+		with h5py.File(self.path, 'r') as file:
+			if zbin not in file:
+				return {}
+
+			for cosmology in file[zbin]:
+				if cosmologies is not None and cosmology not in cosmologies:
+					continue
+				group = file[zbin][cosmology]
+
+				products = {
+					'cosmology': group.attrs['cosmology'],
+					'cosmology_id': group.attrs['cosmology_id'],
+					'persistence_filter': json.loads(group.attrs.get('persistence_filter', 'null')),
+					'los': group['los'].asstr()[()].tolist(),
+					'maps_count': group['maps_count'][()],
+					'map_names': group['map_names'].asstr()[()].tolist(),
+					'map_keys': group['map_keys'].asstr()[()].tolist() if 'map_keys' in group else None,
+					'bngs': group['bngs'][()],
+					'bng_ranges': {dim: group['bng_ranges'][dim] for dim in [0, 1]},
+					'bng_normalizations': group['bng_normalizations'][()] if 'bng_normalizations' in group else None,
+					'bng_thresholds': {dim: group['bng_thresholds'][dim] for dim in [0, 1]} if 'bng_thresholds' in group else None,
+					'resolutions_bngs': {
+						int(name[len('bngs_resolution_'):]): group[name][()] for name in group if name.startswith('bngs_resolution_')
+					},
+					'region_offsets': {dim: group[f'region_offsets_{dim}'][()] for dim in [0, 1]}
+				}
+				if with_pairs:
+					products['region_pairs'] = {
+						dim: RaggedDiagram(group[f'pairs_{dim}'][()], products['region_offsets'][dim]) for dim in [0, 1]
+					}
+				zbin_products[cosmology] = products
+
+		return zbin_products
+
+	def read(self, cosmology, zbin, with_pairs=True):
+		"""
+		:return: Products of one cosmology in a zbin, see read_zbin, None if nothing is stored
+		"""
+		return self.read_zbin(zbin, [cosmology], with_pairs=with_pairs).get(cosmology)
+
+	def read_los_pairs(self, cosmology, zbin, los_index):
+		"""
+		Reads only the pairs of one LOS, los_index is the position of the LOS in the stored los dataset.
+		:return: Dictionary with a RaggedDiagram over the regions of the LOS for every dimension
+		"""
+		with h5py.File(self.path, 'r') as file:
+			group = file[self._group_name(cosmology, zbin)]
+			first_region = np.sum(group['maps_count'][:los_index])
+			maps_count = group['maps_count'][los_index]
+
+			region_pairs = {}
+			for dim in [0, 1]:
+				region_offsets = group[f'region_offsets_{dim}'][first_region:first_region + maps_count + 1]
+				# Only the chunks holding this LOS are read and decompressed
+				pairs = group[f'pairs_{dim}'][region_offsets[0]:region_offsets[-1]]
+				region_pairs[dim] = RaggedDiagram(pairs, region_offsets - region_offsets[0])
+			return region_pairs
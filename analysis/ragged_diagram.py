@@ -0,0 +1,39 @@
+from typing import List
+
+import numpy as np
+
+
+class RaggedDiagram:
+	"""
+	(birth, death) pairs of several diagrams (e.g. the regions of one LOS) stored in one contiguous array.
+	The pairs of diagram i are pairs[offsets[i]:offsets[i + 1]], which is a view and not a copy.
+	"""
+
+	def __init__(self, pairs: np.ndarray, offsets: np.ndarray):
+		self.pairs = pairs
+		self.offsets = np.asarray(offsets)
+
+	@classmethod
+	def from_arrays(cls, arrays: List[np.ndarray]):
+		# Concatenate once, instead of growing an array for every diagram
+		offsets = np.concatenate(([0], np.cumsum([array.shape[0] for array in arrays])))
+		if len(arrays) == 0:
+			return cls(np.empty((0, 2)), offsets)
+		return cls(np.concatenate(arrays, axis=0), offsets)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, index):
+		return self.pairs[self.offsets[index]:self.offsets[index + 1]]
+
+	@property
+	def counts(self):
+		return np.diff(self.offsets)
+
+	def filter(self, mask: np.ndarray):
+		"""
+		Returns a new RaggedDiagram with only the pairs where mask is True, offsets are adjusted accordingly.
+		"""
+		kept_before = np.concatenate(([0], np.cumsum(mask)))
+		return RaggedDiagram(self.pairs[mask], kept_before[self.offsets])
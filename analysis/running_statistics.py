@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class RunningStatistics:
+	"""
+	Mean and standard deviation of a stream of equally shaped arrays, updated one array (or batch of arrays) at a time
+	with Welford's algorithm, so the arrays never have to be held in memory together.
+	The standard deviation is the population standard deviation, like np.std.
+	"""
+
+	def __init__(self):
+		self.count = 0
+		self.mean = None
+		# Sum of squared differences from the mean
+		self.m2 = None
+
+	def update(self, value):
+		"""
+		Adds a single array to the statistics.
+		"""
+		value = np.asarray(value, dtype=float)
+		if self.mean is None:
+			self.mean = np.zeros_like(value)
+			self.m2 = np.zeros_like(value)
+
+		self.count += 1
+		delta = value - self.mean
+		self.mean += delta / self.count
+		self.m2 += delta * (value - self.mean)
+
+	def update_batch(self, values):
+		"""
+		Adds a batch of arrays to the statistics, values has the arrays along its first axis.
+		"""
+		values = np.asarray(values, dtype=float)
+		if len(values) == 0:
+			return
+
+		batch = RunningStatistics()
+		batch.count = len(values)
+		batch.mean = np.mean(values, axis=0)
+		batch.m2 = np.sum(np.square(values - batch.mean), axis=0)
+		self.merge(batch)
+
+	def merge(self, other):
+		"""
+		Combines the statistics of other into these statistics (Chan et al. parallel algorithm).
+		"""
+		if other.count == 0:
+			return
+		if self.count == 0:
+			self.count = other.count
+			self.mean = other.mean.copy()
+			self.m2 = other.m2.copy()
+			return
+
+		count = self.count + other.count
+		delta = other.mean - self.mean
+		self.mean += delta * (other.count / count)
+		self.m2 += other.m2 + np.square(delta) * (self.count * other.count / count)
+		self.count = count
+
+	@property
+	def variance(self):
+		return self.m2 / self.count
+
+	@property
+	def std(self):
+		return np.sqrt(self.variance)
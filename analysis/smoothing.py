@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def gaussian_smooth(histograms: np.ndarray, kernel1d: np.ndarray, engine='direct'):
+	"""
+	Convolves 2D histograms with the 2D kernel np.outer(kernel1d, kernel1d), keeping the size of the histograms
+	like scipy.signal.convolve2d with mode='same'.
+	:param histograms: Array of shape (n, R, R) with n histograms, or (R, R) for a single histogram
+	:param kernel1d: Symmetric 1D kernel, e.g. from scipy.signal.windows.gaussian
+	:param engine: 'direct' convolves every histogram with the 2D kernel, O(R^2 K^2) per histogram for a kernel of K pixels,
+		'separable' convolves with the 1D kernel along each axis, O(R^2 K), 'fft' convolves all histograms at once with FFTs, O(R^2 log R)
+	:return: Array of the same shape as histograms
+	"""
+	from scipy.ndimage import convolve1d
+	from scipy.signal import convolve2d, fftconvolve
+
+	histograms = np.asarray(histograms, dtype=float)
+	single = histograms.ndim == 2
+	if single:
+		histograms = histograms[np.newaxis]
+
+	if engine == 'direct':
+		kernel = np.outer(kernel1d, kernel1d)
+		smoothed = np.array([convolve2d(histogram, kernel, mode='same') for histogram in histograms]).reshape(histograms.shape)
+	elif engine == 'separable':
+		# convolve2d centers kernels of even length one pixel further than convolve1d
+		origin = -1 if len(kernel1d) % 2 == 0 else 0
+		smoothed = convolve1d(histograms, kernel1d, axis=1, mode='constant', origin=origin)
+		smoothed = convolve1d(smoothed, kernel1d, axis=2, mode='constant', origin=origin)
+	elif engine == 'fft':
+		smoothed = fftconvolve(histograms, np.outer(kernel1d, kernel1d)[np.newaxis], mode='same', axes=(1, 2))
+	else:
+		raise ValueError(f'Unknown engine {engine}')
+
+	return smoothed[0] if single else smoothed
+
+
+def smooth_masked(map: np.ndarray, mask: np.ndarray, scales):
+	"""
+	Smooths a map with Gaussians of several scales at once, only the unmasked pixels contribute.
+	The map (with masked pixels set to 0) and the mask are Fourier transformed once, every scale multiplies them with the transform
+	of its Gaussian and all scales are transformed back together. Dividing by the smoothed mask renormalizes the Gaussian to the unmasked pixels.
+	:param mask: Boolean array of the shape of map, True for unmasked pixels
+	:param scales: Standard deviations of the Gaussians in pixels, 0 keeps the map as it is
+	:return: Array of shape (len(scales), *map.shape), masked pixels are inf
+	"""
+	from scipy import fft
+
+	scales = np.asarray(scales, dtype=float)
+	height, width = map.shape
+	# Zero padding of 4 standard deviations keeps the circular convolution from wrapping around
+	pad = int(np.ceil(4 * np.max(scales)))
+	shape = (fft.next_fast_len(height + pad), fft.next_fast_len(width + pad, real=True))
+
+	stacked = np.zeros((2, *shape))
+	stacked[0, :height, :width] = np.where(mask, map, 0)
+	stacked[1, :height, :width] = mask
+	transformed = fft.rfft2(stacked)
+
+	frequencies = np.square(fft.fftfreq(shape[0]))[:, np.newaxis] + np.square(fft.rfftfreq(shape[1]))[np.newaxis, :]
+	transfer = np.exp(-2 * np.pi ** 2 * np.square(scales)[:, np.newaxis, np.newaxis] * frequencies)
+	smoothed = fft.irfft2(transformed[np.newaxis] * transfer[:, np.newaxis], s=shape)[..., :height, :width]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		smoothed = smoothed[:, 0] / smoothed[:, 1]
+	smoothed[:, ~mask] = np.inf
+	return smoothed
@@ -17,6 +17,7 @@ from datetime import datetime
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.preprocessing import StandardScaler
 
+from analysis.cosmology_data import CosmologyData
 from analysis.data_compression.compressor import Compressor
 from analysis.data_compression.full_grid import FullGrid
 from analysis.data_compression.growing_vector_compressor import GrowingVectorCompressor
@@ -34,12 +35,13 @@ from utils.file_system import check_folder_exists
 slics_truths = [0.2905, 0.826 * np.sqrt(0.2905 / .3), 0.6898, -1.0]
 
 
-def read_maps(filter_region=None, force_recalculate=False, plots_dir='plots', products_dir='products', save_plots=False):
+def read_maps(filter_region=None, force_recalculate=False, plots_dir='plots', products_dir='products', save_plots=False, n_workers=1, stream_averages=False):
 	pipeline = Pipeline(
 		filter_region=filter_region, 
 		save_plots=save_plots, force_recalculate=force_recalculate, 
 		do_remember_maps=False, bng_resolution=100, three_sigma_mask=True, lazy_load=True,
-		plots_dir=plots_dir, products_dir=products_dir
+		plots_dir=plots_dir, products_dir=products_dir, n_workers=n_workers,
+		persistence_cache_dir=os.path.join(products_dir, 'persistence_cache'), stream_averages=stream_averages
 	)
 	pipeline.find_max_min_values_maps(save_all_values=False, save_maps=False)
 	# pipeline.all_values_histogram()
@@ -56,14 +58,17 @@ def read_maps(filter_region=None, force_recalculate=False, plots_dir='plots', pr
 
 def save_datas(slics_data, cosmoslics_datas, dist_powers, dir='cosmology_datas'):
 	check_folder_exists(dir)
-	dump(slics_data, os.path.join(dir, 'slics_data.joblib'))
-	dump(cosmoslics_datas, os.path.join(dir, 'cosmoslics_datas.joblib'))
+	# One netCDF file per cosmology instead of pickling the CosmologyDatas with all their PersistenceDiagrams
+	slics_data[0].save(os.path.join(dir, 'slics_data.nc'))
+	for i, cosmoslics_data in enumerate(cosmoslics_datas):
+		# Index in the name keeps the order of the cosmologies
+		cosmoslics_data.save(os.path.join(dir, 'cosmoslics_datas', f'{i:02d}_{cosmoslics_data.cosmology}.nc'))
 	dump(dist_powers, os.path.join(dir, 'dist_powers.joblib'))
 
 
 def load_datas(dir):
-	slics_data = load(os.path.join(dir, 'slics_data.joblib'))
-	cosmoslics_datas = load(os.path.join(dir, 'cosmoslics_datas.joblib'))
+	slics_data = [CosmologyData.load(os.path.join(dir, 'slics_data.nc'))]
+	cosmoslics_datas = [CosmologyData.load(path) for path in sorted(glob.glob(os.path.join(dir, 'cosmoslics_datas', '*.nc')))]
 	dist_powers = load(os.path.join(dir, 'dist_powers.joblib'))
 	return slics_data, cosmoslics_datas, dist_powers
 
@@ -267,6 +272,8 @@ if __name__ == '__main__':
 	map_group = parser.add_argument_group(title='Map reading')
 	map_group.add_argument('-r', '--recalculate', action='store_true', help='Force Pipeline to recalculate PersistenceDiagrams and everything else')
 	map_group.add_argument('--save-plots-pipeline', action='store_true', help='Flag to save plots produced by Pipeline')
+	map_group.add_argument('--n-workers', type=int, default=1, help='Number of processes used to calculate PersistenceDiagrams')
+	map_group.add_argument('--stream-averages', action='store_true', help='Only keep running averages and standard deviations of the cosmoSLICS BettiNumbersGrids, not the grids of every line of sight')
 
 	# Skipping Pipeline, reading CosmologyDatas directly from pickles
 	map_group.add_argument('-lcd', '--load-cosm-data', action='store_true', help='Load CosmologyDatas from directory')
@@ -300,7 +307,8 @@ if __name__ == '__main__':
 		if not args.load_cosm_data:
 			print('Reading maps')
 			slics_data, cosmoslics_datas, dist_powers = read_maps(
-				force_recalculate=args.recalculate, plots_dir=args.plots_dir, products_dir=args.products_dir, save_plots=args.save_plots_pipeline
+				force_recalculate=args.recalculate, plots_dir=args.plots_dir, products_dir=args.products_dir, save_plots=args.save_plots_pipeline,
+				n_workers=args.n_workers, stream_averages=args.stream_averages
 			)
 			print(f'Saving cosmology datas in {args.cosm_data_dir}')
 			save_datas(slics_data, cosmoslics_datas, dist_powers, args.cosm_data_dir)